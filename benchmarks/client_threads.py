@@ -0,0 +1,59 @@
+"""
+Throughput of one Client shared by a growing number of threads.
+
+Bulk encryption and decryption are libsodium calls which release the GIL,
+so they should scale with the number of threads (up to the number of cores).
+
+    python benchmarks/client_threads.py --size 1048576 --operations 200
+"""
+import argparse
+import os
+import threading
+import time
+
+from nacl.utils import random
+from nkms.client import Client
+
+
+def bulk(client, data, key, operations):
+    for _ in range(operations):
+        client.decrypt_bulk(client.encrypt_bulk(data, key), key)
+
+
+def roundtrip(client, data, key, operations):
+    for _ in range(operations):
+        client.decrypt(client.encrypt(data))
+
+
+def measure(target, client, threads, operations, data):
+    """
+    :return: Operations per second, `operations` being split between `threads`
+    """
+    key = random(32)
+    workers = [threading.Thread(target=target, args=(client, data, key, operations // threads))
+               for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return operations // threads * threads / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='Bytes per message')
+    parser.add_argument('--operations', type=int, default=256)
+    parser.add_argument('--max-threads', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    client = Client()
+    data = os.urandom(args.size)
+    threads = 1
+    while threads <= args.max_threads:
+        print('%3s threads: bulk %8.1f ops/s, encrypt+decrypt %8.1f ops/s' % (
+            threads,
+            measure(bulk, client, threads, args.operations, data),
+            measure(roundtrip, client, threads, args.operations, data)))
+        threads *= 2
+    client._nclient.close()
@@ -0,0 +1,95 @@
+"""
+Lookup hops, messages and latency for set_digest and get on a large
+simulated network (see nkms.network.simulation), all in one process.
+
+    python benchmarks/dht_simulation.py --full 2000 --seed-only 500 --latency 0.05 --loss 0.01
+"""
+import argparse
+import asyncio
+import random
+
+from kademlia.utils import digest
+from nkms.network.crawling import StorageNodeSpiderCrawl
+from nkms.network.server import NuCypherDHTServer, NuCypherSeedOnlyDHTServer
+from nkms.network.simulation import SimulatedEventLoop, SimulatedNetwork
+
+
+def percentiles(values, ps=(50, 90, 99)):
+    values = sorted(values)
+    return ' '.join('p%s=%.3f' % (p, values[min(len(values) - 1, len(values) * p // 100)]) for p in ps)
+
+
+def report(name, latencies, messages, hops=None):
+    print('%-12s latency: %s' % (name, percentiles(latencies)))
+    print('%-12s messages: %s' % ('', percentiles(messages)))
+    if hops is not None:
+        print('%-12s hops: %s' % ('', percentiles(hops)))
+
+
+async def measure(network, operation):
+    loop = asyncio.get_event_loop()
+    started, messages = loop.time(), network.messages
+    result = await operation
+    return result, loop.time() - started, network.messages - messages
+
+
+async def lookup(server, key):
+    node = server.node_class(key)
+    nearest = server.protocol.router.findNeighbors(node, can_store=True)
+    spider = StorageNodeSpiderCrawl(server.protocol, node, nearest, server.ksize, server.alpha)
+    await spider.find()
+    return spider.hops
+
+
+async def run(args):
+    network = SimulatedNetwork(latency=args.latency, jitter=args.jitter, loss=args.loss, seed=args.random_seed)
+    rand = random.Random(args.random_seed)
+
+    print('bootstrapping %s full and %s seed-only nodes...' % (args.full, args.seed_only))
+    servers = await network.spawn(NuCypherDHTServer, args.full)
+    servers += await network.spawn(NuCypherSeedOnlyDHTServer, args.seed_only)
+
+    keys = [digest('key-%s' % i) for i in range(args.operations)]
+
+    hops, latencies, messages = [], [], []
+    for key in keys:
+        h, latency, m = await measure(network, lookup(rand.choice(servers), key))
+        hops.append(h)
+        latencies.append(latency)
+        messages.append(m)
+    report('lookup', latencies, messages, hops)
+
+    latencies, messages, failed = [], [], 0
+    for key in keys:
+        ok, latency, m = await measure(network, rand.choice(servers).set_digest(key, b'value'))
+        failed += not ok
+        latencies.append(latency)
+        messages.append(m)
+    report('set_digest', latencies, messages)
+    print('%-12s failed: %s' % ('', failed))
+
+    latencies, messages, missing = [], [], 0
+    for i, key in enumerate(keys):
+        value, latency, m = await measure(network, rand.choice(servers).get('key-%s' % i))
+        missing += value is None
+        latencies.append(latency)
+        messages.append(m)
+    report('get', latencies, messages)
+    print('%-12s missing: %s' % ('', missing))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--full', type=int, default=1000, help='Number of full nodes')
+    parser.add_argument('--seed-only', type=int, default=200, help='Number of seed-only nodes')
+    parser.add_argument('--operations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='One-way latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability of losing a datagram')
+    parser.add_argument('--random-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    loop = SimulatedEventLoop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run(args))
+    loop.close()
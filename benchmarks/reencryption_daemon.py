@@ -0,0 +1,92 @@
+"""
+Re-encryption throughput of a local daemon (see nkms.network.daemon) with
+several client processes, each keeping a number of requests in flight.
+
+    python benchmarks/reencryption_daemon.py --clients 4 --window 64 --workers 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+
+from nkms.crypto import default_algorithm, pre_from_algorithm
+from nkms.network import daemon
+from nkms.network.reencryption import ReencryptionExecutor
+
+
+def run_daemon(socket_path, db_path, workers, ready):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ReencryptionExecutor(workers=workers) if workers else None
+    reencryption_daemon = daemon.ReencryptionDaemon(socket_path, db_path, executor)
+    loop.run_until_complete(reencryption_daemon.start())
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    ready.set()
+    loop.run_forever()
+
+    loop.run_until_complete(reencryption_daemon.stop())
+    if executor is not None:
+        executor.shutdown()
+    loop.close()
+
+
+def run_client(socket_path, ekey, requests, window, results):
+    client = daemon.Client(socket_path)
+    in_flight = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        if len(in_flight) >= window:
+            in_flight.pop(0).result()
+        in_flight.append(client.call('reencrypt', b'pub', b'alice-to-bob', ekey))
+    for reencryption in in_flight:
+        reencryption.result()
+    results.put(time.perf_counter() - started)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=4, help='Client processes')
+    parser.add_argument('--requests', type=int, default=1000, help='Re-encryptions per client')
+    parser.add_argument('--window', type=int, default=32, help='Requests each client keeps in flight')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Re-encryption processes of the daemon (0: on its event loop)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    socket_path = os.path.join(tmpdir, 'daemon.sock')
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_daemon,
+                                     args=(socket_path, os.path.join(tmpdir, 'db'), args.workers, ready))
+    server.start()
+    ready.wait()
+
+    pre = pre_from_algorithm(default_algorithm)
+    sk_alice, sk_bob = b'a' * 32, b'b' * 32
+    client = daemon.Client(socket_path)
+    client.store_rekeys(b'pub', b'alice-to-bob', pre.rekey(sk_alice, pre.priv2pub(sk_bob)), default_algorithm)
+    client.close()
+    ekey = pre.encrypt(pre.priv2pub(sk_alice), os.urandom(32))
+
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=run_client,
+                                       args=(socket_path, ekey, args.requests, args.window, results))
+               for _ in range(args.clients)]
+    started = time.perf_counter()
+    for c in clients:
+        c.start()
+    # Drain the queue before joining, or a client may never exit
+    slowest = max(results.get() for _ in clients)
+    for c in clients:
+        c.join()
+    elapsed = time.perf_counter() - started
+
+    total = args.clients * args.requests
+    print('%s re-encryptions in %.2fs: %.0f/s (%s clients, %s in flight each, %s workers)' % (
+        total, elapsed, total / elapsed, args.clients, args.window, args.workers))
+    print('slowest client: %.0f re-encryptions/s' % (args.requests / slowest))
+    server.terminate()
+    server.join()
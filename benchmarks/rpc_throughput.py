@@ -0,0 +1,78 @@
+"""
+RPC throughput between two nodes over localhost UDP, on asyncio and on uvloop.
+
+    python benchmarks/rpc_throughput.py --requests 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import time
+
+from kademlia.utils import digest
+from nkms.network.admission import AdmissionControl
+from nkms.network.server import NuCypherDHTServer
+
+
+def unlimited():
+    inf = float('inf')
+    return AdmissionControl(store_rate=inf, store_burst=inf, ping_rate=inf, ping_burst=inf,
+                            max_concurrent_stores=inf)
+
+
+async def flood(client, address, rpc, requests, concurrency):
+    """
+    Send `requests` RPCs, at most `concurrency` at a time.
+
+    :return: RPCs answered per second, and how many weren't answered
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    node_id = client.node.id
+
+    async def call(i):
+        async with semaphore:
+            if rpc == 'ping':
+                result = await client.protocol.ping(address, node_id, 0)
+            else:
+                result = await client.protocol.store(address, node_id, digest(i), b'value')
+            return result[0]
+
+    started = time.perf_counter()
+    answered = await asyncio.gather(*map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+    return sum(answered) / elapsed, requests - sum(answered)
+
+
+def run(loop_name, new_event_loop, args):
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    server = NuCypherDHTServer(admission_control=unlimited())
+    server.listen(args.port, '127.0.0.1', recv_buffer=args.rcvbuf, send_buffer=args.sndbuf)
+    client = NuCypherDHTServer(admission_control=unlimited())
+    client.listen(args.port + 1, '127.0.0.1', recv_buffer=args.rcvbuf, send_buffer=args.sndbuf)
+
+    for rpc in ('ping', 'store'):
+        rate, lost = loop.run_until_complete(
+            flood(client, ('127.0.0.1', args.port), rpc, args.requests, args.concurrency))
+        print('%-8s %-6s %8.0f RPCs/s  (%s unanswered)' % (loop_name, rpc, rate, lost))
+
+    client.stop()
+    server.stop()
+    loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=100, help='RPCs in flight at once')
+    parser.add_argument('--port', type=int, default=9468)
+    parser.add_argument('--rcvbuf', type=int, default=4 * 1024 * 1024, help='SO_RCVBUF, bytes')
+    parser.add_argument('--sndbuf', type=int, default=1024 * 1024, help='SO_SNDBUF, bytes')
+    args = parser.parse_args()
+
+    run('asyncio', asyncio.new_event_loop, args)
+    try:
+        import uvloop
+    except ImportError:
+        print('uvloop is not installed, skipping it')
+    else:
+        run('uvloop', uvloop.new_event_loop, args)
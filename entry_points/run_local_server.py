@@ -1,16 +1,96 @@
-from kademlia.network import Server
+"""
+Runs a full node as several worker processes, to make use of all the cores.
+
+Each worker is a node of its own, with its own event loop, node id and port
+(port + i), but all of them share one LMDB environment.  Their ids are spread
+evenly over the keyspace, so each worker gets its own slice of the keys to
+answer for, and the load spreads over the workers the way it spreads over
+nodes.  Whichever worker a value reaches, all of them can serve it, and each
+one republishes only the keys it is the closest worker to.
+
+Unless the network has many more than k nodes per worker, several workers
+are often among the k closest nodes to a key.  Storing on more than one of
+them would make a single replica, so nodes storing values pick one node per
+host (see NuCypherDHTServer.replica_candidates).
+
+SO_REUSEPORT on a single port won't do here: the kernel hashes a peer's
+datagrams to one of the workers regardless of which one sent the request,
+whereas rpcudp expects every reply back at the socket its request went out of.
+"""
+import argparse
 import asyncio
+import multiprocessing
+import os
+import random
+import signal
 
+from kademlia.utils import digest
+from nkms.network.server import NuCypherDHTServer
+from nkms.network.storage import LMDBStorage
 
-if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    server = Server()
-    server.listen(8468)
+
+def run_worker(node_id, worker_ids, interface, port, db_path, seeds):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    # LMDB environments can't be inherited across fork, so each worker opens its own
+    storage = LMDBStorage(db_path)
+    server = NuCypherDHTServer(id=node_id, storage=storage)
+    server.republisher.shared_with = [i for i in worker_ids if i != node_id]
+    server.listen(port, interface)
+    if seeds:
+        loop.run_until_complete(server.bootstrap(seeds))
 
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         pass
 
-    loop.close()
\ No newline at end of file
+    server.stop()
+    storage.close()
+    loop.close()
+
+
+def spread_ids(n):
+    """
+    :return: n random node ids, one in each n-th of the keyspace
+    """
+    bits = len(digest(b'')) * 8
+    width = (1 << bits) // n
+    return [(i * width + random.randrange(width)).to_bytes(bits // 8, byteorder='big') for i in range(n)]
+
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--interface', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8468,
+                        help='Port of the first worker; worker i listens on port + i')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--db-path', default=None,
+                        help='LMDB environment shared by the workers')
+    parser.add_argument('--seed', dest='seeds', action='append', default=[], type=parse_address,
+                        help='host:port of a node to bootstrap from (repeatable)')
+    args = parser.parse_args()
+
+    worker_ids = spread_ids(args.workers)
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(node_id, worker_ids, args.interface, args.port + i, args.db_path, args.seeds))
+               for i, node_id in enumerate(worker_ids)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Pass it on, in case it wasn't sent to the whole process group
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,96 @@
+"""
+Runs a single node, full or seed-only, for production use.
+
+    python entry_points/run_node.py --port 8468 --seed 10.0.0.1:8468 --uvloop
+    python entry_points/run_node.py --capability SeedOnly --routing-table /var/lib/nkms/routing-table
+
+On SIGINT or SIGTERM the node stops taking stores, lets the ones in flight
+finish (for up to --drain-timeout seconds), and only then shuts down.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from nkms.network.capabilities import ServerCapability
+from nkms.network.server import NuCypherDHTServer, NuCypherSeedOnlyDHTServer
+from nkms.network.storage import LMDBStorage
+
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def new_event_loop(use_uvloop=False):
+    if not use_uvloop:
+        return asyncio.new_event_loop()
+    try:
+        import uvloop
+    except ImportError:
+        raise SystemExit("--uvloop needs uvloop installed (pip install uvloop)")
+    return uvloop.new_event_loop()
+
+
+def run_node(args):
+    loop = new_event_loop(args.uvloop)
+    asyncio.set_event_loop(loop)
+    loop.set_debug(args.debug)
+
+    # Rejoin where we were in the keyspace, close to the values we've stored
+    node_id = None
+    if args.routing_table and os.path.exists(args.routing_table):
+        node_id = NuCypherDHTServer.load_routing_table(args.routing_table)[0]
+
+    capabilities = tuple(ServerCapability.from_name(name) for name in args.capabilities)
+    if any(c.prohibits_storage for c in capabilities):
+        storage = None
+        server = NuCypherSeedOnlyDHTServer(id=node_id)
+    else:
+        storage = LMDBStorage(args.db_path)
+        server = NuCypherDHTServer(id=node_id, storage=storage)
+    server.capabilities = capabilities
+
+    server.listen(args.port, args.interface, recv_buffer=args.rcvbuf, send_buffer=args.sndbuf)
+    if args.routing_table:
+        loop.run_until_complete(server.warm_bootstrap(args.routing_table, args.seeds))
+        server.save_routing_table_regularly(args.routing_table)
+    elif args.seeds:
+        loop.run_until_complete(server.bootstrap(args.seeds))
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    loop.run_forever()
+
+    logging.info("Draining before shutdown")
+    loop.run_until_complete(server.drain(args.drain_timeout))
+    if args.routing_table:
+        server.save_routing_table(args.routing_table)
+    if storage is not None:
+        storage.close()
+    loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--interface', default='0.0.0.0', help='Address to listen on ("::" for IPv6)')
+    parser.add_argument('--port', type=int, default=8468)
+    parser.add_argument('--capability', dest='capabilities', action='append', default=[],
+                        choices=ServerCapability.names(),
+                        help='Capability to announce (repeatable)')
+    parser.add_argument('--seed', dest='seeds', action='append', default=[], type=parse_address,
+                        help='host:port of a node to bootstrap from (repeatable)')
+    parser.add_argument('--db-path', default=None, help='LMDB environment for a full node')
+    parser.add_argument('--routing-table', default=None,
+                        help='Where to save the routing table, and warm-bootstrap from on start')
+    parser.add_argument('--uvloop', action='store_true', help='Run on uvloop instead of asyncio')
+    parser.add_argument('--rcvbuf', type=int, default=4 * 1024 * 1024, help='SO_RCVBUF, bytes')
+    parser.add_argument('--sndbuf', type=int, default=1024 * 1024, help='SO_SNDBUF, bytes')
+    parser.add_argument('--drain-timeout', type=float, default=5,
+                        help='Seconds to let in-flight requests finish on shutdown')
+    parser.add_argument('--debug', action='store_true', help='asyncio debug mode and debug logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    run_node(args)
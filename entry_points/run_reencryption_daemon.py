@@ -0,0 +1,39 @@
+"""
+Runs a local re-encryption daemon on a Unix socket (see nkms.network.daemon).
+
+    python entry_points/run_reencryption_daemon.py --socket /tmp/nkms.sock --workers 8
+"""
+import argparse
+import asyncio
+import signal
+
+from nkms.network.daemon import ReencryptionDaemon, default_socket_path
+from nkms.network.reencryption import ReencryptionExecutor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--socket', default=default_socket_path())
+    parser.add_argument('--db-path', default=None, help='LMDB environment for the rekeys')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Re-encryption processes (default: one per core, 0: on the event loop)')
+    parser.add_argument('--max-queued', type=int, default=1024,
+                        help='Re-encryptions allowed to wait for a worker')
+    args = parser.parse_args()
+
+    executor = None
+    if args.workers != 0:
+        executor = ReencryptionExecutor(workers=args.workers, max_queued=args.max_queued)
+
+    loop = asyncio.get_event_loop()
+    daemon = ReencryptionDaemon(args.socket, args.db_path, executor)
+    loop.run_until_complete(daemon.start())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    print("Listening on %s" % args.socket)
+    loop.run_forever()
+
+    loop.run_until_complete(daemon.stop())
+    if executor is not None:
+        executor.shutdown()
+    loop.close()
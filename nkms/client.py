@@ -1,9 +1,13 @@
 import sha3
 import msgpack
+import threading
+from collections import OrderedDict
 from nacl import utils
 from nkms.network import dummy
 from nkms.crypto import (default_algorithm, pre_from_algorithm,
                          symmetric_from_algorithm)
+from nkms.crypto.compression import codec_from_algorithm, compress, decompress
+from nkms.crypto.keycache import DataKeyCache
 from io import BytesIO
 
 
@@ -25,23 +29,41 @@ class Client(object):
     storage backends).
     """
     KEY_LENGTH = 148
+    PATH_KEY_CACHE_SIZE = 1024
     network_client_factory = dummy.Client
 
-    def __init__(self, conf=None):
+    def __init__(self, conf=None, data_key_cache_ttl=None, data_key_cache_size=1024):
         """
+        One Client can be shared by all the threads of a process. The keypair,
+        the network client and the caches are shared; PRE state is kept per
+        thread.
+
         :param str conf: Config file to load/save the key information from. If
             not given, a default one in the home directory is used
             or created
+        :param float data_key_cache_ttl: If set, data keys unwrapped by
+            decrypt() are cached for this many seconds (see DataKeyCache)
+        :param int data_key_cache_size: Max data keys cached
         """
         self._nclient = Client.network_client_factory()
-        self._pre = pre_from_algorithm(default_algorithm)
         self._symm = symmetric_from_algorithm(default_algorithm)
+        # path -> derived public key, least recently used first
+        self._path_pubkeys = OrderedDict()
+        self._path_pubkeys_lock = threading.Lock()
+        self._data_keys = None
+        if data_key_cache_ttl:
+            self._data_keys = DataKeyCache(data_key_cache_ttl, data_key_cache_size)
 
         # TODO: Check for existing keypair before generation
         # TODO: Save newly generated keypair
         self._priv_key = self._pre.gen_priv(dtype='bytes')
         self._pub_key = self._pre.priv2pub(self._priv_key)
 
+    @property
+    def _pre(self):
+        # pre_from_algorithm keeps an instance per thread
+        return pre_from_algorithm(default_algorithm)
+
     def _derive_path_key(self, path, is_pub=True):
         """
         Derives a public key for the specific path.
@@ -52,8 +74,23 @@ class Client(object):
         :return: Derived key
         :rtype: bytes
         """
+        if is_pub:
+            with self._path_pubkeys_lock:
+                pubkey = self._path_pubkeys.pop(path, None)
+                if pubkey is not None:
+                    self._path_pubkeys[path] = pubkey
+                    return pubkey
+
         key = sha3.keccak_256(self._priv_key + path).digest()
-        return self._pre.priv2pub(key) if is_pub else key
+        if not is_pub:
+            return key
+
+        pubkey = self._pre.priv2pub(key)
+        with self._path_pubkeys_lock:
+            self._path_pubkeys[path] = pubkey
+            if len(self._path_pubkeys) > self.PATH_KEY_CACHE_SIZE:
+                self._path_pubkeys.popitem(last=False)
+        return pubkey
 
     def _split_path(self, path):
         """
@@ -71,21 +108,25 @@ class Client(object):
         dirs = path.split(b'/')
         return [b'/'.join(dirs[:i + 1]) for i in range(len(dirs))]
 
-    def _build_header(self, enc_keys, version=100):
+    def _build_header(self, enc_keys, version=100, codec_id=0):
         """
         Creates a NuCypher header for the encrypted file.
 
         :param enc_keys: List of encrypted keys in bytes
-        :param version: Version number of Cryptographic API (default: 0.1.0.0)
+        :param version: Version number of Cryptographic API (default: 0.1.0.0).
+            Version 101 also records the compression codec.
+        :param int codec_id: Codec the data was compressed with (see
+            nkms.crypto.compression), 0 if it wasn't
 
         :return: Complete header msgpack encoded and length of raw header
         :rtype: Tuple of the header and the header length e.g: (<header>, 1200)
         """
         if version < 1000:
             vers_bytes = version.to_bytes(4, byteorder='big')
+            codec_bytes = codec_id.to_bytes(1, byteorder='big') if version >= 101 else b''
             num_keys_bytes = len(enc_keys).to_bytes(4, byteorder='big')
             keys = b''.join(enc_keys)
-            header = msgpack.dumps(vers_bytes + num_keys_bytes + keys)
+            header = msgpack.dumps(vers_bytes + codec_bytes + num_keys_bytes + keys)
         return (header, len(header))
 
     def _read_header(self, header):
@@ -94,19 +135,22 @@ class Client(object):
 
         :param header: Msgpack encoded header to read
 
-        :return: Version number, and list of encrypted keys
-        :rtype: Tuple of an int and a list e.g: (100, [...])
+        :return: Version number, list of encrypted keys and compression codec
+        :rtype: Tuple of an int, a list and an int e.g: (100, [...], 0)
         """
         header = BytesIO(msgpack.loads(header))
         vers_bytes = header.read(4)
         version = int.from_bytes(vers_bytes, byteorder='big')
 
         # Handle pre-alpha versions
+        codec_id = 0
         if version < 1000:
+            if version >= 101:
+                codec_id = int.from_bytes(header.read(1), byteorder='big')
             num_keys_bytes = header.read(4)
             num_keys = int.from_bytes(num_keys_bytes, byteorder='big')
             enc_keys = [header.read(Client.KEY_LENGTH) for _ in range(num_keys)]
-        return (version, enc_keys)
+        return (version, enc_keys, codec_id)
 
     def encrypt_key(self, key, pubkey=None, path=None, algorithm=None):
         """
@@ -256,10 +300,14 @@ class Client(object):
         """
         pass
 
-    def encrypt(self, data, path=None, algorithm=None):
+    def encrypt(self, data, path=None, algorithm=None, compression=None):
         """
         Encrypts data in a form ready to ship to the storage layer.
 
+        Data can be compressed before it's encrypted, with a codec given by
+        name (e.g. 'zlib', 'lzma', 'bz2') or by algorithm['compression']['codec'].
+        Incompressible data is left as is.
+
         :param bytes data: Data to encrypt
         :param tuple(str) path: Path to the data (to be able to share
             sub-paths). If None, encrypted with just our pubkey.
@@ -267,10 +315,16 @@ class Client(object):
             unique identifier w/o granular encryption.
         :param dict algorithm: Algorithm parameters (name, curve, re-encryption
             type, m/n etc). None if default
+        :param str compression: Codec to compress data with, if any
 
         :return: Encrypted data
         :rtype: bytes
         """
+        codec_id = 0
+        codec = compression or codec_from_algorithm(algorithm)
+        if codec:
+            codec_id, data = compress(data, codec)
+
         # Generate a secure key and encrypt the data
         data_key = utils.random(32)
         ciphertext = msgpack.dumps(self.encrypt_bulk(data, data_key))
@@ -283,7 +337,9 @@ class Client(object):
             enc_keys = [self.encrypt_key(data_key, path=path)]
 
         # Build the header
-        header, header_length = self._build_header(enc_keys)
+        # Version 100 headers stay readable by clients which predate compression
+        header, header_length = self._build_header(
+                enc_keys, version=101 if codec_id else 100, codec_id=codec_id)
 
         # Format for storage
         header_length_bytes = header_length.to_bytes(4, byteorder='big')
@@ -308,16 +364,34 @@ class Client(object):
 
         header_length = int.from_bytes(enc_file.read(4), byteorder='big')
         header = enc_file.read(header_length)
-        version, enc_keys = self._read_header(header)
+        version, enc_keys, codec_id = self._read_header(header)
 
         ciphertext = msgpack.loads(enc_file.read())
 
         if version < 1000:
             valid_key = None
-            for enc_key in enc_keys:
-                dec_key = self.decrypt_key(enc_key, path=path)
-                if len(dec_key) == 32:
-                    valid_key = dec_key
-                    break
+            if self._data_keys is not None:
+                # With a path, the key which decrypts is the last one, so
+                # look them all up before decrypting any of them
+                for enc_key in enc_keys:
+                    valid_key = self._data_keys.get(enc_key, path)
+                    if valid_key is not None:
+                        break
+            if valid_key is None:
+                for enc_key in enc_keys:
+                    dec_key = self.decrypt_key(enc_key, path=path)
+                    if len(dec_key) == 32:
+                        valid_key = dec_key
+                        if self._data_keys is not None:
+                            self._data_keys.put(enc_key, dec_key, path)
+                        break
             plaintext = self.decrypt_bulk(ciphertext, valid_key)
+            plaintext = decompress(plaintext, codec_id)
         return plaintext
+
+    def purge_data_keys(self):
+        """
+        Zero and forget all the data keys cached by decrypt(), if any.
+        """
+        if self._data_keys is not None:
+            self._data_keys.purge()
@@ -1,4 +1,5 @@
 import importlib
+import threading
 from nacl.utils import random  # noqa
 
 # 'Random' parameter g here is derived from Bitcoin's hashMerkleRoot of
@@ -18,17 +19,35 @@ default_algorithm = dict(
             m=None, n=None))
 
 
+# Cipher name -> Cipher class. Filling it twice does no harm, so no lock
+_symmetric_ciphers = {}
+# PRE instances keep their EC group state around, so each thread gets its own
+_pre_instances = threading.local()
+
+
 def symmetric_from_algorithm(algorithm):
-    module = importlib.import_module(
-            'nkms.crypto.block.' + algorithm['symmetric']['cipher'])
-    # TODO need to cache this
-    return module.Cipher
+    name = algorithm['symmetric']['cipher']
+    cipher = _symmetric_ciphers.get(name)
+    if cipher is None:
+        module = importlib.import_module('nkms.crypto.block.' + name)
+        cipher = _symmetric_ciphers[name] = module.Cipher
+    return cipher
 
 
 def pre_from_algorithm(algorithm):
-    kw = {k: v for k, v in algorithm['pre'].items()
-          if k != 'cipher' and v is not None}
-    module = importlib.import_module(
-            'nkms.crypto.pre.' + algorithm['pre']['cipher'])
-    # TODO need to cache this
-    return module.PRE(**kw)
+    """
+    :return: A PRE instance for algorithm, cached for the calling thread
+    """
+    try:
+        cache = _pre_instances.cache
+    except AttributeError:
+        cache = _pre_instances.cache = {}
+    key = tuple(sorted(algorithm['pre'].items()))
+    pre = cache.get(key)
+    if pre is None:
+        kw = {k: v for k, v in algorithm['pre'].items()
+              if k != 'cipher' and v is not None}
+        module = importlib.import_module(
+                'nkms.crypto.pre.' + algorithm['pre']['cipher'])
+        pre = cache[key] = module.PRE(**kw)
+    return pre
@@ -0,0 +1,67 @@
+import bz2
+import lzma
+import zlib
+
+# Codec id (as recorded in headers, so never reuse one) -> (name, compress, decompress)
+_codecs = {}
+_codec_ids = {}
+
+# Don't bother compressing what wouldn't shrink below this fraction of its size
+MAX_RATIO = 0.9
+# Inputs larger than this are first tried on a sample of this size
+SAMPLE_SIZE = 64 * 1024
+
+
+def register_codec(codec_id, name, compress, decompress):
+    """
+    :param int codec_id: 1-255, recorded in the header of encrypted data
+    :param str name: Name to choose the codec by, e.g. in Client.encrypt
+    :param compress: bytes -> bytes
+    :param decompress: bytes -> bytes
+    """
+    if not 0 < codec_id < 256:
+        raise ValueError("Codec ids go from 1 to 255")
+    if codec_id in _codecs:
+        raise ValueError("Codec id %s is already taken by %s" % (codec_id, _codecs[codec_id][0]))
+    _codecs[codec_id] = (name, compress, decompress)
+    _codec_ids[name] = codec_id
+
+
+def codec_from_algorithm(algorithm):
+    """
+    :return: Name of the codec the algorithm dict asks for, if any
+    """
+    return (algorithm or {}).get('compression', {}).get('codec')
+
+
+def compress(data, codec):
+    """
+    Compress data, unless it's incompressible.
+
+    :param bytes data: Data to compress
+    :param str codec: Name of the codec to use
+
+    :return: The codec id used (0 if none) and the data it produced
+    :rtype: tuple
+    """
+    codec_id = _codec_ids[codec]
+    _, compress_fn, _ = _codecs[codec_id]
+    if len(data) > SAMPLE_SIZE:
+        sample = data[:SAMPLE_SIZE]
+        if len(compress_fn(sample)) > MAX_RATIO * len(sample):
+            return 0, data
+    compressed = compress_fn(data)
+    if len(compressed) > MAX_RATIO * len(data):
+        return 0, data
+    return codec_id, compressed
+
+
+def decompress(data, codec_id):
+    if codec_id == 0:
+        return data
+    return _codecs[codec_id][2](data)
+
+
+register_codec(1, 'zlib', zlib.compress, zlib.decompress)
+register_codec(2, 'lzma', lzma.compress, lzma.decompress)
+register_codec(3, 'bz2', bz2.compress, bz2.decompress)
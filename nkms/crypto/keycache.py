@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+import sha3
+
+
+class DataKeyCache(object):
+    """
+    Unwrapped data keys, by a hash of the wrapped (PRE-encrypted) key and the
+    path it was derived for, so that decrypting the same object again costs
+    only the symmetric decryption.
+
+    Keys are kept for `ttl` seconds, at most `max_entries` of them, in
+    bytearrays which are zeroed when they're evicted, expire or get purged.
+    Copies handed out by get() are ordinary bytes and can't be zeroed.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # hash -> (expires, bytearray), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(enc_key, path):
+        # None (our own key) and b'' (the root path) are different paths
+        tag = b'\x00' if path is None else b'\x01' + path
+        return sha3.keccak_256(tag + b'\x00' + enc_key).digest()
+
+    def get(self, enc_key, path=None):
+        """
+        :return: The data key enc_key unwraps to, or None if it's not cached
+        :rtype: bytes
+        """
+        h = self._hash(enc_key, path)
+        with self.lock:
+            entry = self.entries.pop(h, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._zeroize(entry[1])
+                self.misses += 1
+                return None
+            self.entries[h] = entry
+            self.hits += 1
+            return bytes(entry[1])
+
+    def put(self, enc_key, data_key, path=None):
+        h = self._hash(enc_key, path)
+        with self.lock:
+            # Drop expired keys (and any old key for h). Puts follow PRE
+            # decryptions, which cost far more than this sweep
+            now = time.monotonic()
+            for stale in [k for k, (expires, _) in self.entries.items() if expires < now or k == h]:
+                self._zeroize(self.entries.pop(stale)[1])
+            while len(self.entries) >= self.max_entries:
+                self._zeroize(self.entries.popitem(last=False)[1][1])
+            self.entries[h] = (now + self.ttl, bytearray(data_key))
+
+    def purge(self):
+        """
+        Zero and forget every cached key.
+        """
+        with self.lock:
+            for _, data_key in self.entries.values():
+                self._zeroize(data_key)
+            self.entries.clear()
+
+    @staticmethod
+    def _zeroize(data_key):
+        data_key[:] = bytes(len(data_key))
@@ -1,18 +1,64 @@
 import base64
 import msgpack
+from collections import OrderedDict
 from nkms import crypto
 from npre.bbs98 import PRE as BasePRE
 
+# Re-encrypted (type 2) messages are msgpacked [2, epriv, emsg]
+TYPE_2_PREFIX = b'\x93\x02'
+
 
 def convert_priv(sk):
     return b'0:' + base64.encodebytes(sk).strip()
 
 
+class ReKey(object):
+    """
+    A rekey as PRE.rekey makes it, parsed: the re-encryption key is a
+    deserialized group element, ready to be applied to many messages.
+    """
+    __slots__ = ('rk', 'epriv')
+
+    def __init__(self, rk, epriv):
+        self.rk = rk
+        self.epriv = epriv
+
+
+class Ciphertext(object):
+    """
+    An encrypted message, with the envelope of a re-encrypted (type 2)
+    one taken off: epriv is the re-encryption private key encrypted for the
+    recipient, or None for a message which wasn't re-encrypted.
+
+    Only the envelope is parsed.  emsg stays serialized, as npre's decrypt
+    takes it, and npre parses its group elements on every decrypt.
+    """
+    __slots__ = ('emsg', 'epriv')
+
+    def __init__(self, emsg, epriv=None):
+        self.emsg = emsg
+        self.epriv = epriv
+
+    @classmethod
+    def from_bytes(cls, emsg):
+        # Peek at the type instead of deserializing messages twice
+        if emsg[:2] == TYPE_2_PREFIX:
+            _, epriv, emsg = msgpack.loads(emsg)
+            return cls(emsg, epriv)
+        return cls(emsg)
+
+
 class PRE(BasePRE):
     """
     Public key based single-hop version of BBS98.
     """
     KEY_SIZE = 32
+    REKEY_CACHE_SIZE = 1024
+
+    def __init__(self, *args, **kwargs):
+        super(PRE, self).__init__(*args, **kwargs)
+        # rekey id -> (rekey, ReKey), least recently used first
+        self._rekeys = OrderedDict()
 
     def priv2pub(self, priv):
         """
@@ -31,19 +77,52 @@ class PRE(BasePRE):
         epriv_to = self.encrypt(pub2, priv_to)
         return msgpack.dumps([rk, epriv_to])
 
-    def reencrypt(self, rekey, emsg):
+    def load_rekey(self, rekey, rekey_id=None):
+        """
+        Parse a rekey. Given its id, the parsed rekey is cached, and parsed
+        again only if a different rekey turns up under the same id.
+
+        :param rekey: Rekey (bytes) as made by rekey(), or a ReKey
+        :param rekey_id: Any hashable id of the rekey, e.g. its DHT key
+
+        :rtype: ReKey
+        """
+        if isinstance(rekey, ReKey):
+            return rekey
+        if rekey_id is not None:
+            cached = self._rekeys.pop(rekey_id, None)
+            if cached is not None and cached[0] == rekey:
+                self._rekeys[rekey_id] = cached
+                return cached[1]
+
         rk, epriv = msgpack.loads(rekey)
-        remsg = super(PRE, self).reencrypt(rk, emsg)
-        return msgpack.dumps([2, epriv, remsg])  # type 2 emsg
+        parsed = ReKey(self.load_key(rk), epriv)
+        if rekey_id is not None:
+            self._rekeys[rekey_id] = (rekey, parsed)
+            if len(self._rekeys) > self.REKEY_CACHE_SIZE:
+                self._rekeys.popitem(last=False)
+        return parsed
+
+    def reencrypt(self, rekey, emsg, rekey_id=None):
+        rekey = self.load_rekey(rekey, rekey_id)
+        remsg = super(PRE, self).reencrypt(rekey.rk, emsg)
+        return msgpack.dumps([2, rekey.epriv, remsg])  # type 2 emsg
+
+    def reencrypt_many(self, rekey, emsgs, rekey_id=None):
+        """
+        Re-encrypt several messages, parsing the rekey only once
+        """
+        rekey = self.load_rekey(rekey, rekey_id)
+        return [msgpack.dumps([2, rekey.epriv, super(PRE, self).reencrypt(rekey.rk, emsg)])
+                for emsg in emsgs]
 
     def decrypt(self, priv, emsg, padding=True):
-        # This is non-optimal b/c of double-deserialization
-        # but this cipher is for development/tests, not production
-        # so be it
-        emsg_l = msgpack.loads(emsg)
-        if emsg_l[0] == 2:
-            _, epriv_to, emsg = emsg_l
-            priv_to = self.decrypt(priv, epriv_to)
-            priv = priv_to
+        """
+        :param emsg: Encrypted message (bytes) or a Ciphertext
+        """
+        if not isinstance(emsg, Ciphertext):
+            emsg = Ciphertext.from_bytes(emsg)
+        if emsg.epriv is not None:
+            priv = self.decrypt(priv, emsg.epriv)
         return super(PRE, self).decrypt(
-                convert_priv(priv), emsg, padding=padding)
+                convert_priv(priv), emsg.emsg, padding=padding)
@@ -2,20 +2,58 @@ import appdirs
 import lmdb
 import msgpack
 import os.path
+import threading
 
 CONFIG_APPNAME = 'nucypher-kms'
 DB_NAME = 'rekeys-db'
 
+# LMDB must not be opened more than once per process on the same path, so
+# DBs on the same path share one environment: real path -> [env, users]
+_environments = {}
+_environments_lock = threading.Lock()
+
+
+def _open_environment(path, lmdb_options):
+    key = os.path.realpath(path)
+    with _environments_lock:
+        entry = _environments.get(key)
+        if entry is None:
+            entry = _environments[key] = [lmdb.open(path, **lmdb_options), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _close_environment(path):
+    key = os.path.realpath(path)
+    with _environments_lock:
+        entry = _environments.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            entry[0].close()
+            del _environments[key]
+
 
 class DB(object):
-    def __init__(self, path=None):
+    """
+    A msgpacked key-value store on LMDB.
+
+    It's safe to share one DB between threads, as every operation runs in a
+    transaction of its own.  DBs opened on the same path in one process share
+    one LMDB environment, opened with the options of whichever DB came first;
+    it's closed when the last of them is.
+    """
+
+    def __init__(self, path=None, **lmdb_options):
         self.path = path or os.path.join(
                 appdirs.user_data_dir(CONFIG_APPNAME), DB_NAME)
         db_dir = os.path.dirname(self.path)
         if not os.path.exists(db_dir):
             os.makedirs(db_dir)
 
-        self.db = lmdb.open(self.path)
+        self.db = _open_environment(self.path, lmdb_options)
+        self._closed = False
         # XXX removal when expired? Indexing by time?
 
     def __setitem__(self, key, value):
@@ -40,4 +78,6 @@ class DB(object):
             return cursor.set_key(key)
 
     def close(self):
-        self.db.close()
+        if not self._closed:
+            self._closed = True
+            _close_environment(self.path)
@@ -0,0 +1,95 @@
+import asyncio
+from collections import OrderedDict
+
+
+class TokenBucket(object):
+    """
+    Lets through `rate` events a second on average, in bursts of at most `burst`.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = asyncio.get_event_loop().time()
+
+    def take(self, tokens=1):
+        now = asyncio.get_event_loop().time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class AdmissionControl(object):
+    """
+    Decides which incoming requests a node takes on, so that a burst of them
+    can't saturate its event loop and storage.
+
+    Each peer gets a token bucket per rate-limited RPC (store and ping), and
+    the number of stores being handled at once is capped across all peers.
+    A store_many costs as many tokens as it carries items.
+    Requests which don't get through are answered with NODE_IS_OVERLOADED
+    straight away (see NuCypherHashProtocol._solveDatagram).
+    """
+
+    def __init__(self, store_rate=200, store_burst=1000, ping_rate=20, ping_burst=40,
+                 max_concurrent_stores=1000, max_peers=10000):
+        """
+        :param float store_rate: Stores a second allowed from each peer
+        :param int store_burst: Stores a peer may send in a burst
+        :param float ping_rate: Pings a second allowed from each peer
+        :param int ping_burst: Pings a peer may send in a burst
+        :param int max_concurrent_stores: Stores handled at once, from all peers
+        :param int max_peers: Peers whose buckets we remember (least recently seen go first)
+        """
+        self.limits = {'store': (store_rate, store_burst), 'ping': (ping_rate, ping_burst)}
+        self.max_concurrent_stores = max_concurrent_stores
+        self.max_peers = max_peers
+        self.buckets = OrderedDict()  # (rpc, peer address) -> TokenBucket
+        self.stores_in_flight = 0
+        self.rejected = 0
+        # Set while the node shuts down (see NuCypherDHTServer.drain)
+        self.draining = False
+
+    def admit(self, rpc, peer, items=1):
+        """
+        :param str rpc: Name of the RPC requested, e.g. 'store'
+        :param tuple peer: (ip, port) the request came from
+        :param int items: Number of items a batched request carries
+
+        :return: Whether to handle the request
+        :rtype: bool
+        """
+        if rpc == 'store_many':
+            rpc = 'store'
+        limits = self.limits.get(rpc)
+        if limits is None:
+            return True
+        if rpc == 'store' and (self.draining or self.stores_in_flight >= self.max_concurrent_stores):
+            self.rejected += 1
+            return False
+
+        key = (rpc, tuple(peer))
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            if len(self.buckets) >= self.max_peers:
+                self.buckets.popitem(last=False)
+            bucket = TokenBucket(*limits)
+        self.buckets[key] = bucket
+        if not bucket.take(items):
+            self.rejected += 1
+            return False
+        return True
+
+    def track_store(self, request):
+        """
+        Count a store as being handled until its request future is done.
+        """
+        self.stores_in_flight += 1
+        request.add_done_callback(self._store_done)
+
+    def _store_done(self, request):
+        self.stores_in_flight -= 1
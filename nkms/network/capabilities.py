@@ -1,12 +1,42 @@
-from contextlib import suppress
-
 from bidict import bidict
+
+# Capability name <-> capability class, so that capabilities can be sent by name.
 _capability_mapping = bidict()
+# Capability bit -> capability class, for the compact bitmask encoding.
+_capability_bits = {}
+# All the capabilities which prohibit storage, as a bitmask.
+_prohibits_storage_mask = 0
+
+
+def register_capability(bit):
+    """
+    Class decorator adding a capability to the registry.
+
+    :param int bit: Position of the capability in capability bitmasks. This
+        goes on the wire, so it must never change once assigned.
+    """
+    def register(capability_class):
+        global _prohibits_storage_mask
+        capability_class.bit = 1 << bit
+        if capability_class.bit in _capability_bits:
+            raise ValueError("Capability bit %s is already taken by %s" % (
+                bit, _capability_bits[capability_class.bit].__name__))
+        _capability_bits[capability_class.bit] = capability_class
+        _capability_mapping[capability_class.__name__] = capability_class
+        if capability_class.prohibits_storage:
+            _prohibits_storage_mask |= capability_class.bit
+        return capability_class
+    return register
+
+
+def prohibits_storage(capability_mask):
+    return bool(capability_mask & _prohibits_storage_mask)
 
 
 class ServerCapability(object):
 
     prohibits_storage = False
+    bit = 0
 
     @staticmethod
     def stringify(capability):
@@ -17,24 +47,45 @@ class ServerCapability(object):
 
         return string_repr
 
+    @staticmethod
+    def names():
+        return sorted(_capability_mapping)
+
     @staticmethod
     def from_name(capability_name, *args, **kwargs):
         capability_class = _capability_mapping[capability_name]
         return capability_class(*args, **kwargs)
 
+    @staticmethod
+    def to_bitmask(capabilities):
+        """
+        :param capabilities: Capability instances or classes
+        :rtype: int
+        """
+        mask = 0
+        for capability in capabilities:
+            mask |= capability.bit
+        return mask
 
-class SeedOnly(ServerCapability):
-    prohibits_storage = True
+    @staticmethod
+    def from_bitmask(capability_mask):
+        return [capability_class() for bit, capability_class in sorted(_capability_bits.items())
+                if capability_mask & bit]
 
+    @staticmethod
+    def bitmask_from_wire(capabilities):
+        """
+        Capabilities are announced as a list of names, which older nodes
+        expect, but some nodes send a bitmask instead; accept both.
+        """
+        if isinstance(capabilities, int):
+            return capabilities
+        mask = 0
+        for capability_name in capabilities:
+            mask |= _capability_mapping[capability_name].bit
+        return mask
 
-# What follows is a rather shameful hack to provide compatibity with kademlia's serialization, which uses umsgpack.
-# Obviously by iterating only locals we prevent users from defining capabilities elsehwere.
-# Other, somewhat better ways of doing this:
-# * use a decorator-registry.
-# * monkeypatch rpcudp.protocol.__getaddr__.func to allow a serialization method to be injected
-# * Override __getaddr_ completely
-for l in list(locals().values()):
-    with suppress(TypeError):
-        if issubclass(l, ServerCapability):
-            _capability_mapping[l.__name__] = l
 
+@register_capability(0)
+class SeedOnly(ServerCapability):
+    prohibits_storage = True
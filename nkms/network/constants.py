@@ -1 +1,6 @@
-NODE_HAS_NO_STORAGE = 350
\ No newline at end of file
+NODE_HAS_NO_STORAGE = 350
+NODE_STORE_TIMED_OUT = 351
+NODE_IS_BUSY = 352
+NODE_IS_OVERLOADED = 353
+# rpcudp refuses to send requests bigger than this (name and args, msgpacked)
+MAX_RPC_SIZE = 8192
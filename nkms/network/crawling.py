@@ -0,0 +1,128 @@
+import asyncio
+from collections import OrderedDict, defaultdict
+
+from kademlia.crawling import NodeSpiderCrawl, RPCFindResponse
+
+
+class StorageNodeSpiderCrawl(NodeSpiderCrawl):
+    """
+    Crawl for the k nodes closest to a key which are able to store values.
+
+    Peers are asked only for their storage-capable neighbors, so seed-only
+    nodes never take up one of the k places.  Peers which predate that RPC
+    return all their neighbors instead, so the ones we know can't store are
+    left out here as well.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hops = 0
+
+    @property
+    def rpcs(self):
+        return len(self.nearest.contacted)
+
+    async def find(self):
+        self.hops += 1
+        return await self._find(self.protocol.callFindStorageNode)
+
+    async def _nodesFound(self, responses):
+        toremove = []
+        for peerid, response in responses.items():
+            response = RPCFindResponse(response)
+            if not response.happened():
+                toremove.append(peerid)
+            else:
+                nodes = response.getNodeList()
+                self.nearest.push([n for n in nodes if self.protocol.router.can_store(n)])
+        self.nearest.remove(toremove)
+
+        if self.nearest.allBeenContacted():
+            return list(self.nearest)
+        return await self.find()
+
+
+class LookupCache(object):
+    """
+    Recent crawl results, so that keys landing close to one we've just looked
+    up (e.g. grants for one owner) reuse its closest nodes instead of crawling
+    the network again.
+
+    Results are bucketed by the first `prefix_bits` bits of the key, and
+    expire after `ttl` seconds or as soon as the routing table drops one of
+    their nodes. The hops and RPCs the cache saved are counted.
+    """
+
+    def __init__(self, ttl=60, prefix_bits=16, max_entries=10000):
+        self.ttl = ttl
+        self.prefix_bits = prefix_bits
+        self.max_entries = max_entries
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()  # prefix -> (expires, nodes, hops, rpcs)
+        self.prefixes_by_node = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.hops_saved = 0
+        self.rpcs_saved = 0
+
+    def _prefix(self, key):
+        return int.from_bytes(key, byteorder='big') >> (len(key) * 8 - self.prefix_bits)
+
+    def _evict(self, prefix):
+        _, nodes, _, _ = self.entries.pop(prefix)
+        for n in nodes:
+            self.prefixes_by_node[n.id].discard(prefix)
+            if not self.prefixes_by_node[n.id]:
+                del self.prefixes_by_node[n.id]
+
+    def peek(self, node, k):
+        """
+        The cached nodes closest to node, if any, w/o counting a hit.
+        """
+        prefix = self._prefix(node.id)
+        entry = self.entries.get(prefix)
+        if entry is None:
+            return None
+        if entry[0] < asyncio.get_event_loop().time():
+            self._evict(prefix)
+            return None
+        return sorted(entry[1], key=node.distanceTo)[:k]
+
+    def get(self, node, k):
+        """
+        The cached nodes closest to node, standing in for a crawl.
+        """
+        nodes = self.peek(node, k)
+        if nodes is None:
+            self.misses += 1
+            return None
+        _, _, hops, rpcs = self.entries[self._prefix(node.id)]
+        self.hits += 1
+        self.hops_saved += hops
+        self.rpcs_saved += rpcs
+        return nodes
+
+    def put(self, node, nodes, hops=0, rpcs=0):
+        """
+        Remember the result of a crawl for node, which took `hops` rounds and
+        `rpcs` RPCs.
+        """
+        if not nodes:
+            return
+        prefix = self._prefix(node.id)
+        if prefix in self.entries:
+            self._evict(prefix)
+        elif len(self.entries) >= self.max_entries:
+            self._evict(next(iter(self.entries)))
+        self.entries[prefix] = (asyncio.get_event_loop().time() + self.ttl, list(nodes), hops, rpcs)
+        for n in nodes:
+            self.prefixes_by_node[n.id].add(prefix)
+
+    def invalidate(self, node):
+        """
+        Forget every result which includes node (e.g. because it failed).
+        """
+        for prefix in list(self.prefixes_by_node.get(node.id, ())):
+            self._evict(prefix)
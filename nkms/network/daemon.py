@@ -0,0 +1,245 @@
+"""
+A local re-encryption service on a Unix domain socket, standing in for the
+network so that many client processes can share one re-encryption backend
+on one machine (for load tests, mostly):
+
+    python entry_points/run_reencryption_daemon.py --workers 8 &
+    Client.network_client_factory = nkms.network.daemon.Client
+
+Requests and responses are msgpacked and prefixed with their length (4 bytes,
+big-endian).  A request is [request id, method, args], its response
+[request id, error, result], where error is None or [error type, message].
+A client may send any number of requests without waiting for responses, and
+responses come back in whatever order the requests complete.
+"""
+import asyncio
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import Future
+
+import appdirs
+import msgpack
+
+from nkms import crypto
+from nkms.db import CONFIG_APPNAME, DB
+from nkms.network.reencryption import ReencryptionQueueFull
+
+DAEMON_DB_NAME = 'daemon-rekeys-db'
+DAEMON_SOCKET_NAME = 'reencryption.sock'
+
+_length = struct.Struct('>I')
+
+
+def default_socket_path():
+    return os.path.join(appdirs.user_data_dir(CONFIG_APPNAME), DAEMON_SOCKET_NAME)
+
+
+def _pack(message):
+    data = msgpack.dumps(message, use_bin_type=True)
+    return _length.pack(len(data)) + data
+
+
+class DaemonError(Exception):
+    pass
+
+
+class ReencryptionDaemon(object):
+    """
+    Serves store_rekeys, remove_rekeys, reencrypt and reencrypt_many, as in
+    nkms.network.dummy.Client, to any number of connections.
+
+    With a ReencryptionExecutor, re-encryptions run on all the cores, in
+    batches by rekey; without one they run on the event loop.
+    """
+
+    def __init__(self, path=None, db_path=None, reencryption_executor=None):
+        """
+        :param str path: Unix socket to listen on
+        :param str db_path: LMDB environment the rekeys are kept in
+        :param ReencryptionExecutor reencryption_executor: Where to re-encrypt
+        """
+        self.path = path or default_socket_path()
+        self.storage = DB(db_path or os.path.join(appdirs.user_data_dir(CONFIG_APPNAME), DAEMON_DB_NAME))
+        self.reencryption_executor = reencryption_executor
+        self.server = None
+        self.requests = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, self.path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.storage.close()
+
+    async def _serve(self, reader, writer):
+        pending = set()
+        try:
+            while True:
+                length, = _length.unpack(await reader.readexactly(_length.size))
+                request_id, method, args = msgpack.loads(await reader.readexactly(length), raw=False)
+                # Each request runs on its own, so a slow one doesn't hold up the rest
+                request = asyncio.ensure_future(self._respond(writer, request_id, method, args))
+                pending.add(request)
+                request.add_done_callback(pending.discard)
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            for request in pending:
+                request.cancel()
+            writer.close()
+
+    async def _respond(self, writer, request_id, method, args):
+        self.requests += 1
+        try:
+            if method not in ('store_rekeys', 'remove_rekeys', 'reencrypt', 'reencrypt_many'):
+                raise DaemonError("no such method: %s" % method)
+            result = await getattr(self, method)(*args)
+            response = [request_id, None, result]
+        except Exception as e:
+            response = [request_id, [e.__class__.__name__, str(e)], None]
+        if not writer.transport.is_closing():
+            writer.write(_pack(response))
+
+    async def store_rekeys(self, pub, k, rekeys, algorithm):
+        if type(rekeys) in (list, tuple) and len(rekeys) == 1:
+            rekeys = rekeys[0]
+        self.storage[k] = {b'rk': rekeys, b'algorithm': algorithm}
+
+    async def remove_rekeys(self, pub, k):
+        del self.storage[k]
+
+    async def reencrypt(self, pub, k, ekey):
+        stored = self.storage[k]
+        rekey, algorithm = stored[b'rk'], stored[b'algorithm']
+        if type(rekey) not in (list, tuple):
+            return await self._reencrypt(k, algorithm, rekey, ekey)
+
+        m = algorithm['pre'].get('m') or len(rekey)
+        pieces = [self._reencrypt(k + bytes([i]), algorithm, share, ekey)
+                  for i, share in enumerate(rekey[:m])]
+        return [[i, piece] for i, piece in enumerate(await asyncio.gather(*pieces))]
+
+    async def reencrypt_many(self, pub, k, ekeys):
+        stored = self.storage[k]
+        rekey, algorithm = stored[b'rk'], stored[b'algorithm']
+        if type(rekey) not in (list, tuple):
+            return await self._reencrypt_many(k, algorithm, rekey, ekeys)
+
+        m = algorithm['pre'].get('m') or len(rekey)
+        pieces = await asyncio.gather(*[self._reencrypt_many(k + bytes([i]), algorithm, share, ekeys)
+                                        for i, share in enumerate(rekey[:m])])
+        return [[[i, reencrypted[j]] for i, reencrypted in enumerate(pieces)]
+                for j in range(len(ekeys))]
+
+    async def _reencrypt_many(self, rekey_id, algorithm, rekey, ekeys):
+        if self.reencryption_executor is None:
+            return crypto.pre_from_algorithm(algorithm).reencrypt_many(rekey, ekeys, rekey_id=rekey_id)
+        return await asyncio.gather(*self.reencryption_executor.reencrypt_many(rekey_id, algorithm, rekey, ekeys))
+
+    async def _reencrypt(self, rekey_id, algorithm, rekey, ekey):
+        if self.reencryption_executor is None:
+            return crypto.pre_from_algorithm(algorithm).reencrypt(rekey, ekey, rekey_id=rekey_id)
+        return await self.reencryption_executor.reencrypt(rekey_id, algorithm, rekey, ekey)
+
+
+class Client(object):
+    """
+    Network client talking to a ReencryptionDaemon, a drop-in for
+    nkms.network.dummy.Client:
+
+        Client.network_client_factory = nkms.network.daemon.Client
+
+    One connection is shared by all the threads using the client; their
+    requests are pipelined on it, and a reader thread hands each response to
+    whoever is waiting for it.  call() returns a Future, for callers which
+    want several requests in flight themselves.
+    """
+
+    def __init__(self, path=None, **kw):
+        """
+        :param str path: Unix socket the daemon listens on
+        """
+        self.path = path or default_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+        self._send_lock = threading.Lock()
+        self._pending = {}  # request id -> Future
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    def call(self, method, *args):
+        """
+        :return: Future of the method's result
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        with self._pending_lock:
+            request_id = self._next_id = self._next_id + 1
+            self._pending[request_id] = future
+        data = _pack([request_id, method, list(args)])
+        try:
+            with self._send_lock:
+                self._sock.sendall(data)
+        except OSError:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise
+        return future
+
+    def _read_responses(self):
+        stream = self._sock.makefile('rb')
+        try:
+            while True:
+                header = stream.read(_length.size)
+                if len(header) < _length.size:
+                    break
+                length, = _length.unpack(header)
+                request_id, error, result = msgpack.loads(stream.read(length), raw=False)
+                with self._pending_lock:
+                    future = self._pending.pop(request_id)
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(self._exception(*error))
+        except Exception:
+            # Whatever went wrong, nothing more can be read from this connection
+            pass
+        finally:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(DaemonError("connection to the daemon closed"))
+
+    @staticmethod
+    def _exception(error_type, message):
+        if error_type == 'KeyError':
+            return KeyError(message)
+        if error_type == 'ReencryptionQueueFull':
+            return ReencryptionQueueFull(message)
+        return DaemonError("%s: %s" % (error_type, message))
+
+    def store_rekeys(self, pub, k, rekeys, algorithm):
+        return self.call('store_rekeys', pub, k, rekeys, algorithm).result()
+
+    def remove_rekeys(self, pub, k):
+        return self.call('remove_rekeys', pub, k).result()
+
+    def reencrypt(self, pub, k, ekey):
+        return self.call('reencrypt', pub, k, ekey).result()
+
+    def reencrypt_many(self, pub, k, ekeys):
+        return self.call('reencrypt_many', pub, k, ekeys).result()
+
+    def close(self):
+        self._sock.shutdown(socket.SHUT_RDWR)
+        self._sock.close()
+        self._reader.join()
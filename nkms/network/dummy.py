@@ -33,11 +33,10 @@ class Client(object):
         :param dict algorithm: Parameters of the re-encryption algo
         :param bytes sig: Digital signature of hash(k, metainfo)
         """
-        if type(rekeys) in (list, tuple):
-            if len(rekeys) > 1:
-                raise NotImplementedError(
-                        'm-of-n reencryption not yet available')
+        if type(rekeys) in (list, tuple) and len(rekeys) == 1:
             rekeys = rekeys[0]
+        # In the network, each of the n shares lives on its own node
+        # (see NuCypherDHTServer.store_rekey_shares). Here they're all local.
         # Should specify and check signature also
         self._storage[k] = {b'rk': rekeys, b'algorithm': algorithm}
 
@@ -50,11 +49,39 @@ class Client(object):
         :param bytes pub: Public (signing) key
         :param bytes k: Address of the rekey derived from the path/pubkey
         :param bytes ekey: Encrypted symmetric key to reencrypt
+
+        :return: Reencrypted key or, for m-of-n reencryption, a list of m
+            [share index, reencrypted key] pairs
+        """
+        rekey = self._storage[k][b'rk']
+        algorithm = self._storage[k][b'algorithm']
+        pre = crypto.pre_from_algorithm(algorithm)
+        if type(rekey) not in (list, tuple):
+            return pre.reencrypt(rekey, ekey, rekey_id=k)
+
+        m = algorithm['pre'].get('m') or len(rekey)
+        return [[i, pre.reencrypt(share, ekey, rekey_id=(k, i))]
+                for i, share in enumerate(rekey[:m])]
+
+    def reencrypt_many(self, pub, k, ekeys):
+        """
+        Same as reencrypt, for several ekeys under one rekey, which is only
+        decoded once. The network does this in one round trip per share
+        holder (see NuCypherDHTServer.reencrypt_digest_many).
+
+        :return: For each ekey, what reencrypt would return for it
+        :rtype: list
         """
         rekey = self._storage[k][b'rk']
         algorithm = self._storage[k][b'algorithm']
         pre = crypto.pre_from_algorithm(algorithm)
-        return pre.reencrypt(rekey, ekey)
+        if type(rekey) not in (list, tuple):
+            return pre.reencrypt_many(rekey, ekeys, rekey_id=k)
+
+        m = algorithm['pre'].get('m') or len(rekey)
+        pieces = [pre.reencrypt_many(share, ekeys, rekey_id=(k, i)) for i, share in enumerate(rekey[:m])]
+        return [[[i, reencrypted[j]] for i, reencrypted in enumerate(pieces)]
+                for j in range(len(ekeys))]
 
     def close(self):
         """
@@ -1,22 +1,46 @@
-from kademlia.node import Node
-from nkms.network.capabilities import ServerCapability
+from nkms.network.capabilities import ServerCapability, prohibits_storage
 
 
-class NuCypherNode(Node):
+class NuCypherNode(object):
+    """
+    A kademlia node which knows what its server is capable of.
 
-    def __init__(self, id, ip=None, port=None, capabilities=None, capabilities_as_strings=[], *args, **kwargs):
+    Routing tables hold a lot of these, so there is no per-instance dict and
+    capabilities are kept as a bitmask (see nkms.network.capabilities).
+    Otherwise this behaves like kademlia.node.Node.
+    """
+    __slots__ = ('id', 'ip', 'port', 'long_id', 'capability_mask')
+
+    def __init__(self, id, ip=None, port=None, capabilities=None, capabilities_as_strings=(), capability_mask=0):
         self.id = id
         self.ip = ip
         self.port = port
-        self.long_id = int(id.hex(), 16)
+        self.long_id = int.from_bytes(id, byteorder='big')
 
-        self.capabilities = capabilities or []
+        if capabilities:
+            capability_mask |= ServerCapability.to_bitmask(capabilities)
+        if capabilities_as_strings:
+            capability_mask |= ServerCapability.bitmask_from_wire(capabilities_as_strings)
+        self.capability_mask = capability_mask
 
-        for capability_name in capabilities_as_strings:
-            self.capabilities.append(ServerCapability.from_name(capability_name))
+    @property
+    def capabilities(self):
+        return ServerCapability.from_bitmask(self.capability_mask)
 
     def can_store(self):
-        for c in self.capabilities:
-            if c.prohibits_storage:
-                return False
-        return True
+        return not prohibits_storage(self.capability_mask)
+
+    def sameHomeAs(self, node):
+        return self.ip == node.ip and self.port == node.port
+
+    def distanceTo(self, node):
+        return self.long_id ^ node.long_id
+
+    def __iter__(self):
+        return iter([self.id, self.ip, self.port])
+
+    def __repr__(self):
+        return repr([self.long_id, self.ip, self.port])
+
+    def __str__(self):
+        return "%s:%s" % (self.ip, str(self.port))
@@ -1,41 +1,362 @@
 import asyncio
 
+import umsgpack
+
 from kademlia.node import Node
 from kademlia.protocol import KademliaProtocol
 from kademlia.utils import digest
-from nkms.network.constants import NODE_HAS_NO_STORAGE
+from nkms import crypto
+from nkms.network.admission import AdmissionControl
+from nkms.network.capabilities import ServerCapability
+from nkms.network.constants import MAX_RPC_SIZE, NODE_HAS_NO_STORAGE, NODE_IS_BUSY, NODE_IS_OVERLOADED
 from nkms.network.node import NuCypherNode
+from nkms.network.reencryption import ReencryptionQueueFull
 from nkms.network.routing import NuCypherRoutingTable
+from nkms.network.storage import LMDBStorage
+
+
+def is_rekey_share(value):
+    """
+    Shares of an m-of-n rekey live on exactly one node each, so they must
+    never be replicated or republished the way ordinary values are.  Their
+    holders refresh them locally instead (see RepublishScheduler).
+    """
+    return isinstance(value, dict) and b'share' in value
+
+
+def split_into_batches(items, max_size=MAX_RPC_SIZE - 256):
+    """
+    Split items into lists whose msgpacked size stays under max_size, so
+    that each fits in one RPC along with the rest of its arguments.
+    """
+    batches, batch, size = [], [], 0
+    for item in items:
+        item_size = len(umsgpack.packb(item))
+        if batch and size + item_size > max_size:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(item)
+        size += item_size
+    if batch:
+        batches.append(batch)
+    return batches
 
 
 class NuCypherHashProtocol(KademliaProtocol):
-    def __init__(self, sourceNode, storage, ksize, *args, **kwargs):
+    # Items sent to a node at once in store_many, and then a second, so as to
+    # stay within its admission control (see AdmissionControl's store_burst
+    # and store_rate), leaving room for other stores
+    store_many_burst = 500
+    store_many_rate = 200
+    # Keys looked at between yields to the event loop when handing keys over
+    # to new nodes
+    handover_chunk = 100
+
+    def __init__(self, sourceNode, storage, ksize, reencryption_executor=None, admission_control=None,
+                 *args, **kwargs):
         super().__init__(sourceNode, storage, ksize, *args, **kwargs)
         self.router = NuCypherRoutingTable(self, ksize, sourceNode)
+        # Without an executor (see nkms.network.reencryption), re-encryption runs on the event loop
+        self.reencryption_executor = reencryption_executor
+        self.admission_control = admission_control or AdmissionControl()
+        self._newcomers = []
+        self._handover = None
+
+    async def _solveDatagram(self, datagram, address):
+        """
+        Same as in rpcudp, except that requests go through admission control
+        first.  The ones it turns away are answered with NODE_IS_OVERLOADED
+        without being handled at all.
+        """
+        if datagram[:1] != b'\x00' or len(datagram) < 22:
+            return await super()._solveDatagram(datagram, address)
+
+        msgID = datagram[1:21]
+        data = umsgpack.unpackb(datagram[21:])
+        rpc, args = data if isinstance(data, list) and len(data) == 2 else (None, None)
+        items = 1
+        if rpc == 'store_many' and isinstance(args, list) and len(args) == 2:
+            items = len(args[1])
+        if not self.admission_control.admit(rpc, address, items):
+            self.log.debug("overloaded, turning away %s request from %s" % (rpc, str(address)))
+            self.transport.sendto(b'\x01' + msgID + umsgpack.packb(NODE_IS_OVERLOADED), address)
+            return
+
+        request = asyncio.ensure_future(self._acceptRequest(msgID, data, address))
+        if rpc in ('store', 'store_many'):
+            self.admission_control.track_store(request)
 
     def check_node_for_storage(self, node):
-        try:
-            return node.can_store()
-        except AttributeError:
-            return True
+        return self.router.can_store(node)
 
-    def rpc_ping(self, sender, nodeid, node_capabilities=[]):
-        source = NuCypherNode(nodeid, sender[0], sender[1], capabilities_as_strings=node_capabilities)
+    def rpc_ping(self, sender, nodeid, node_capabilities=None):
+        # kademlia's own pings (e.g. of a full bucket's head) carry no capabilities,
+        # which doesn't mean the node has none; keep what it announced before.
+        capability_mask = ServerCapability.bitmask_from_wire(node_capabilities or [])
+        source = NuCypherNode(nodeid, sender[0], sender[1], capability_mask=capability_mask)
         self.welcomeIfNewNode(source)
+        if node_capabilities is not None:
+            # Known contacts may announce new capabilities
+            self.router.remember_capabilities(source)
         return self.sourceNode.id
 
+    def rpc_find_storage_node(self, sender, nodeid, key):
+        source = Node(nodeid, sender[0], sender[1])
+        self.welcomeIfNewNode(source)
+        node = Node(key)
+        neighbors = self.router.findNeighbors(node, exclude=source, can_store=True)
+        return list(map(tuple, neighbors))
+
+    async def callFindStorageNode(self, nodeToAsk, nodeToFind):
+        """
+        Ask nodeToAsk for the storage nodes it knows closest to nodeToFind.
+
+        Nodes from before find_storage_node never answer it, so until we know
+        which kind nodeToAsk is, it's asked with find_node at the same time
+        (and a dead node costs one timeout, not two).  Whichever answers first
+        is used, leaving it to the caller to filter out nodes which can't
+        store; whether find_storage_node is ever answered decides how
+        nodeToAsk is asked from then on.
+        """
+        address = (nodeToAsk.ip, nodeToAsk.port)
+        if self.router.is_legacy(nodeToAsk):
+            result = await self.find_node(address, self.sourceNode.id, nodeToFind.id)
+            return self.handleCallResponse(result, nodeToAsk)
+
+        storage_lookup = asyncio.ensure_future(self.find_storage_node(address, self.sourceNode.id, nodeToFind.id))
+        if self.router.is_current(nodeToAsk):
+            return self.handleCallResponse(await storage_lookup, nodeToAsk)
+
+        lookup = asyncio.ensure_future(self.find_node(address, self.sourceNode.id, nodeToFind.id))
+        await asyncio.wait({storage_lookup, lookup}, return_when=asyncio.FIRST_COMPLETED)
+        if storage_lookup.done() and storage_lookup.result()[0]:
+            self.router.mark_current(nodeToAsk)
+            return self.handleCallResponse(storage_lookup.result(), nodeToAsk)
+
+        result = await lookup
+        if not result[0]:
+            # Dead, most likely, and storage_lookup times out along with lookup
+            return self.handleCallResponse(await storage_lookup, nodeToAsk)
+
+        def learn_whether_legacy(storage_lookup):
+            if storage_lookup.result()[0]:
+                self.router.mark_current(nodeToAsk)
+            else:
+                self.router.mark_legacy(nodeToAsk)
+
+        result = self.handleCallResponse(result, nodeToAsk)
+        if storage_lookup.done():
+            learn_whether_legacy(storage_lookup)
+        else:
+            storage_lookup.add_done_callback(learn_whether_legacy)
+        return result
+
+    async def rpc_reencrypt(self, sender, nodeid, key, ekey):
+        source = NuCypherNode(nodeid, sender[0], sender[1])
+        self.welcomeIfNewNode(source)
+        stored = self.storage.get(key)
+        if stored is None:
+            return None
+
+        if self.reencryption_executor is None:
+            pre = crypto.pre_from_algorithm(stored[b'algorithm'])
+            return [stored.get(b'share'), pre.reencrypt(stored[b'rk'], ekey, rekey_id=key)]
+
+        try:
+            reencryption = self.reencryption_executor.reencrypt(key, stored[b'algorithm'], stored[b'rk'], ekey)
+        except ReencryptionQueueFull:
+            self.log.warning("too busy to re-encrypt for %s" % str(sender))
+            return NODE_IS_BUSY
+        return [stored.get(b'share'), await reencryption]
+
+    async def callReencrypt(self, nodeToAsk, key, ekey):
+        address = (nodeToAsk.ip, nodeToAsk.port)
+        # TODO: encrypt `ekey` with public key of nodeToAsk
+        result = await self.reencrypt(address, self.sourceNode.id, key, ekey)
+        return self.handleCallResponse(result, nodeToAsk)
+
+    async def rpc_reencrypt_many(self, sender, nodeid, key, ekeys):
+        source = NuCypherNode(nodeid, sender[0], sender[1])
+        self.welcomeIfNewNode(source)
+        stored = self.storage.get(key)
+        if stored is None:
+            return None
+
+        if self.reencryption_executor is None:
+            pre = crypto.pre_from_algorithm(stored[b'algorithm'])
+            return [stored.get(b'share'), pre.reencrypt_many(stored[b'rk'], ekeys, rekey_id=key)]
+
+        try:
+            reencryptions = self.reencryption_executor.reencrypt_many(key, stored[b'algorithm'], stored[b'rk'], ekeys)
+        except ReencryptionQueueFull:
+            self.log.warning("too busy to re-encrypt for %s" % str(sender))
+            return NODE_IS_BUSY
+        return [stored.get(b'share'), list(await asyncio.gather(*reencryptions))]
+
+    async def callReencryptMany(self, nodeToAsk, key, ekeys):
+        """
+        Re-encrypt ekeys with the rekey (share) nodeToAsk holds under key, in
+        as few RPCs as fit them.
+
+        :return: (response received, [share index, re-encrypted ekeys]), or
+            (True, NODE_IS_BUSY) / (True, None) as for callReencrypt
+        """
+        address = (nodeToAsk.ip, nodeToAsk.port)
+        results = await asyncio.gather(*[self.reencrypt_many(address, self.sourceNode.id, key, batch)
+                                         for batch in split_into_batches(ekeys)])
+        results = [self.handleCallResponse(result, nodeToAsk) for result in results]
+        for response_received, response in results:
+            if not response_received or not isinstance(response, list):
+                return response_received, response
+        return True, [results[0][1][0], [r for _, (_, batch) in results for r in batch]]
+
+    def handleCallResponse(self, result, node):
+        """
+        Same as in kademlia, except that a contact is only dropped from the
+        routing table once it failed to answer several RPCs in a row (see
+        NuCypherRoutingTable.report_failure).
+        """
+        if not result[0]:
+            self.log.warning("no response from %s" % node)
+            self.router.report_failure(node)
+            return result
+
+        self.router.report_success(node)
+        self.welcomeIfNewNode(node)
+        return result
+
+    def welcomeIfNewNode(self, node):
+        """
+        Same as in kademlia, except that rekey shares stay where they are, and
+        that the keys a new node should hold are handed over in the background
+        (see _hand_over_keys) rather than by scanning storage on the spot.
+        """
+        if not self.router.isNewNode(node):
+            return
+
+        self.log.info("never seen %s before, adding to router" % node)
+        self.router.addContact(node)
+        self._newcomers.append(node)
+        if self._handover is None or self._handover.done():
+            self._handover = asyncio.ensure_future(self._hand_over_keys())
+
+    async def _hand_over_keys(self):
+        """
+        Send new nodes the values which they should now hold and which we're
+        the closest to.  Nodes that show up during a scan wait for the next
+        one, so that storage is read once per batch of them; the scan yields
+        to the event loop every handover_chunk keys.
+        """
+        while self._newcomers:
+            newcomers, self._newcomers = self._newcomers, []
+            # LMDBStorage is read a page at a time; in-memory storages are
+            # copied (keys only), as they can't be iterated while stores come in
+            storage = self.storage
+            keys = iter(storage) if isinstance(storage, LMDBStorage) else list(storage)
+            for scanned, key in enumerate(keys, 1):
+                if scanned % self.handover_chunk == 0:
+                    await asyncio.sleep(0)
+                keynode = Node(digest(key))
+                value = None
+                for node in newcomers:
+                    neighbors = self.router.findNeighbors(keynode, exclude=node)
+                    if len(neighbors) > 0:
+                        last = neighbors[-1].distanceTo(keynode)
+                        newNodeClose = node.distanceTo(keynode) < last
+                        first = neighbors[0].distanceTo(keynode)
+                        thisNodeClosest = self.sourceNode.distanceTo(keynode) < first
+                    if len(neighbors) == 0 or (newNodeClose and thisNodeClosest):
+                        if value is None:
+                            value = storage.get(key)
+                            if value is None or is_rekey_share(value):
+                                break
+                        asyncio.ensure_future(self.callStore(node, key, value))
+
     async def callStore(self, nodeToAsk, key, value):
         # nodeToAsk = NuCypherNode
         if self.check_node_for_storage(nodeToAsk):
+            if self.router.is_overloaded(nodeToAsk):
+                # It turned us away recently; give it a rest
+                return NODE_IS_OVERLOADED, False
             address = (nodeToAsk.ip, nodeToAsk.port)
             # TODO: encrypt `value` with public key of nodeToAsk
             store_future = self.store(address, self.sourceNode.id, key, value)
             result = await store_future
             success, data = self.handleCallResponse(result, nodeToAsk)
+            if data == NODE_IS_OVERLOADED:
+                self.router.mark_overloaded(nodeToAsk)
+                return NODE_IS_OVERLOADED, False
             return success, data
         else:
             return NODE_HAS_NO_STORAGE, False
 
+    def rpc_store_many(self, sender, nodeid, items):
+        """
+        Store several [key, value] pairs at once.
+
+        :return: Whether each of them was stored
+        """
+        source = Node(nodeid, sender[0], sender[1])
+        self.welcomeIfNewNode(source)
+        self.log.debug("got a store_many request from %s with %s items" % (str(sender), len(items)))
+        for key, value in items:
+            self.storage[key] = value
+        return [True] * len(items)
+
+    def store_many_duration(self, items):
+        """
+        Seconds it takes callStoreMany to send `items` items to a node.
+        """
+        return max(0, items - self.store_many_burst) / self.store_many_rate
+
+    async def callStoreMany(self, nodeToAsk, items):
+        """
+        Store several (key, value) pairs on nodeToAsk, in as few RPCs as fit
+        them.  Beyond store_many_burst items, the RPCs are spread out so as to
+        send store_many_rate items a second, and if nodeToAsk says it's
+        overloaded, the rest aren't sent at all.
+
+        :return: (disposition, [value_was_set for each item]), the disposition
+            being as for callStore
+        """
+        items = [list(item) for item in items]
+        if not self.check_node_for_storage(nodeToAsk):
+            return NODE_HAS_NO_STORAGE, [False] * len(items)
+        if self.router.is_overloaded(nodeToAsk):
+            return NODE_IS_OVERLOADED, [False] * len(items)
+
+        address = (nodeToAsk.ip, nodeToAsk.port)
+
+        async def store_batch(batch):
+            # TODO: encrypt values with public key of nodeToAsk
+            result = await self.store_many(address, self.sourceNode.id, batch)
+            success, data = self.handleCallResponse(result, nodeToAsk)
+            if data == NODE_IS_OVERLOADED:
+                self.router.mark_overloaded(nodeToAsk)
+                return NODE_IS_OVERLOADED, [False] * len(batch)
+            return success, data if isinstance(data, list) else [False] * len(batch)
+
+        loop = asyncio.get_event_loop()
+        started, sent, stores = loop.time(), 0, []
+        for batch in split_into_batches(items):
+            delay = started + self.store_many_duration(sent + len(batch)) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.router.is_overloaded(nodeToAsk):
+                break
+            stores.append(asyncio.ensure_future(store_batch(batch)))
+            sent += len(batch)
+
+        results = await asyncio.gather(*stores)
+        stored = [value_was_set for _, batch_stored in results for value_was_set in batch_stored]
+        dispositions = [disposition for disposition, _ in results]
+        if sent < len(items):
+            dispositions.append(NODE_IS_OVERLOADED)
+            stored.extend([False] * (len(items) - sent))
+        if NODE_IS_OVERLOADED in dispositions:
+            return NODE_IS_OVERLOADED, stored
+        return next((d for d in dispositions if d is not True), True), stored
+
 
 class NuCypherSeedOnlyProtocol(NuCypherHashProtocol):
     def __init__(self, *args, **kwargs):
@@ -48,3 +369,11 @@ class NuCypherSeedOnlyProtocol(NuCypherHashProtocol):
             "got a store request from %s, but THIS VALUE WILL NOT BE STORED as this is a seed-only node." % str(
                 sender))
         return True
+
+    def rpc_store_many(self, sender, nodeid, items):
+        source = Node(nodeid, sender[0], sender[1])
+        self.welcomeIfNewNode(source)
+        self.log.debug(
+            "got a store_many request from %s, but THESE VALUES WILL NOT BE STORED as this is a seed-only node." % str(
+                sender))
+        return [True] * len(items)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from nkms import crypto
+
+
+def reencrypt_batch(algorithm, rekey, ekeys, rekey_id=None):
+    """
+    Re-encrypt a batch of ekeys with one rekey. This runs in a worker
+    process, which keeps the rekeys it has parsed, by id, for later batches.
+    """
+    pre = crypto.pre_from_algorithm(algorithm)
+    return pre.reencrypt_many(rekey, ekeys, rekey_id=rekey_id)
+
+
+class ReencryptionQueueFull(Exception):
+    pass
+
+
+class ReencryptionExecutor(object):
+    """
+    Runs re-encryptions, which are CPU-bound EC work, in a pool of worker
+    processes so that they never stall the event loop.
+
+    While all the workers are busy, incoming requests queue up grouped by
+    rekey, and each group goes to the next free worker as a single batch.
+    The queue is bounded: once `max_queued` requests are waiting, new ones
+    are rejected with ReencryptionQueueFull straight away, rather than
+    letting latency grow without bound.
+    """
+
+    def __init__(self, workers=None, max_queued=1024, max_batch=64):
+        """
+        :param int workers: Number of worker processes (default: one per core)
+        :param int max_queued: Requests allowed to wait for a worker
+        :param int max_batch: Max requests sent to a worker at once
+        """
+        self.workers = workers or os.cpu_count()
+        self.max_queued = max_queued
+        self.max_batch = max_batch
+        self.queued = 0
+        self.in_flight = 0
+        self._pool = ProcessPoolExecutor(self.workers)
+        # rekey id -> (algorithm, rekey, [(ekey, future), ...]), oldest first
+        self._batches = OrderedDict()
+
+    def reencrypt(self, rekey_id, algorithm, rekey, ekey):
+        """
+        :param bytes rekey_id: ID of the rekey, requests are batched by it
+        :param dict algorithm: Parameters of the re-encryption algo
+        :param bytes rekey: Rekey to re-encrypt with
+        :param bytes ekey: Encrypted symmetric key to re-encrypt
+
+        :return: Future of the re-encrypted key
+        :raises ReencryptionQueueFull: If the node is too busy to take it
+        """
+        return self.reencrypt_many(rekey_id, algorithm, rekey, [ekey])[0]
+
+    def reencrypt_many(self, rekey_id, algorithm, rekey, ekeys):
+        """
+        Same as reencrypt, for several ekeys: either all of them are taken,
+        or none of them are.
+
+        :return: Futures of the re-encrypted keys
+        :raises ReencryptionQueueFull: If the node is too busy to take them all
+        """
+        if self.queued + len(ekeys) > self.max_queued:
+            raise ReencryptionQueueFull()
+
+        loop = asyncio.get_event_loop()
+        if rekey_id not in self._batches:
+            self._batches[rekey_id] = (algorithm, rekey, [])
+        requests = [(ekey, loop.create_future()) for ekey in ekeys]
+        self._batches[rekey_id][2].extend(requests)
+        self.queued += len(requests)
+        self._dispatch()
+        return [future for _, future in requests]
+
+    def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        while self._batches and self.in_flight < self.workers:
+            rekey_id, (algorithm, rekey, requests) = next(iter(self._batches.items()))
+            batch, rest = requests[:self.max_batch], requests[self.max_batch:]
+            if rest:
+                self._batches[rekey_id] = (algorithm, rekey, rest)
+                self._batches.move_to_end(rekey_id)
+            else:
+                del self._batches[rekey_id]
+
+            self.queued -= len(batch)
+            self.in_flight += 1
+            job = loop.run_in_executor(
+                    self._pool, reencrypt_batch, algorithm, rekey, [ekey for ekey, _ in batch], rekey_id)
+            job.add_done_callback(partial(self._batch_done, batch))
+
+    def _batch_done(self, batch, job):
+        self.in_flight -= 1
+        try:
+            results = job.result()
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        self._dispatch()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,186 @@
+import asyncio
+from collections import OrderedDict
+
+from nkms.network.node import NuCypherNode
+from nkms.network.protocols import is_rekey_share
+from nkms.network.storage import LMDBStorage
+
+
+class RepublishScheduler(object):
+    """
+    Republishes stored values a little at a time, instead of sending every
+    key older than an hour to its k closest nodes on every refresh.
+
+    When a key was last published is its birthday in storage: it's reset by
+    every store we receive for it, and by our own republishing. A key is due
+    once `refresh_at` of its TTL has gone by without anyone publishing it,
+    so of its k holders only the first to get there sends it out, and the
+    others just have their birthdays reset. Due keys are found by scanning
+    storage from the oldest birthday on (a cursor scan, with LMDBStorage).
+
+    Keys also move when one of their closest nodes leaves our routing table:
+    the routing table records departures (of contacts which stopped
+    answering, see NuCypherRoutingTable.report_failure), and after some the
+    whole storage is scanned for keys which had one of the departed nodes
+    among their closest.  Those go only to the nodes which took its place.
+    Nothing is kept per key.
+
+    Rekey shares are never sent anywhere: once due, a share just has its
+    birthday reset locally, so that it lasts as long as its holder does.
+
+    Nodes sharing one storage (see entry_points/run_local_server.py) each
+    republish only the keys they're the closest of them to.
+
+    Both scans go at `scan_rate` keys a second. Keys going out are grouped by
+    the node they go to, each node gets its keys in one store_many, and no
+    more than `rate` keys go out a second.
+    """
+
+    def __init__(self, server, refresh_at=0.75, rate=100, batch_size=1000, scan_rate=10000):
+        """
+        :param server: The NuCypherDHTServer whose storage we republish
+        :param float refresh_at: Fraction of its TTL after which a key which
+            nobody has published since is republished
+        :param int rate: Max keys sent per second
+        :param int batch_size: Keys collected before sending them out
+        :param int scan_rate: Max keys looked at per second
+        """
+        self.server = server
+        self.refresh_at = refresh_at
+        self.rate = rate
+        self.batch_size = batch_size
+        self.scan_rate = scan_rate
+        self.keys_republished = 0
+        self.keys_scanned = 0
+        self.shares_refreshed = 0
+        self.running = False
+        # Ids of the other nodes sharing our storage
+        self.shared_with = ()
+
+    @property
+    def due_age(self):
+        """
+        Age (seconds since it was last published) at which a key is due.
+        """
+        return self.server.storage.ttl * self.refresh_at
+
+    def closest_nodes(self, dkey):
+        router = self.server.protocol.router
+        nodes = router.findNeighbors(NuCypherNode(dkey), can_store=True)
+        return [n for n in nodes if n.id != self.server.node.id]
+
+    def is_ours(self, dkey):
+        """
+        Whether we, and not one of the nodes we share storage with, are the
+        one to republish dkey.
+        """
+        key = int.from_bytes(dkey, byteorder='big')
+        distance = self.server.node.long_id ^ key
+        return all(distance < int.from_bytes(other, byteorder='big') ^ key for other in self.shared_with)
+
+    async def _pace(self, scanned):
+        """
+        Sleep after every batch_size keys scanned, so as to go through at
+        most scan_rate of them a second.
+        """
+        if scanned % self.batch_size == 0:
+            await asyncio.sleep(self.batch_size / self.scan_rate)
+
+    async def run(self):
+        """
+        Republish what needs republishing: keys which are due, then, if any
+        of our contacts left, keys which had them among their closest nodes.
+
+        A run with a lot to send (e.g. after downtime) can take longer than
+        the refresh interval; until it's over, later runs do nothing.
+        """
+        if self.running:
+            self.server.log.info("Still republishing, not starting again")
+            return
+        self.running = True
+        try:
+            await self.republish_due()
+            router = self.server.protocol.router
+            if router.departed:
+                departed, router.departed = list(router.departed.values()), OrderedDict()
+                await self.republish_moved(departed)
+        finally:
+            self.running = False
+
+    async def republish_due(self):
+        storage = self.server.storage
+        due = []
+        for scanned, (dkey, value) in enumerate(storage.iteritemsOlderThan(self.due_age), 1):
+            self.keys_scanned += 1
+            await self._pace(scanned)
+            if not self.is_ours(dkey):
+                continue
+            # Each share of a rekey belongs on exactly one node, so nobody
+            # else will publish it again: its holder keeps it from expiring
+            if is_rekey_share(value):
+                storage[dkey] = value
+                self.shares_refreshed += 1
+                continue
+            due.append((dkey, value, self.closest_nodes(dkey)))
+            if len(due) >= self.batch_size:
+                await self._republish(due, refresh=True)
+                due = []
+        if due:
+            await self._republish(due, refresh=True)
+
+    async def republish_moved(self, departed):
+        """
+        :param list departed: Nodes which left our routing table
+        """
+        storage = self.server.storage
+        ksize = self.server.ksize
+        # LMDBStorage is read a page at a time; in-memory storages are copied
+        # (keys only), as they can't be iterated while stores come in
+        keys = iter(storage) if isinstance(storage, LMDBStorage) else list(storage)
+        moved = []
+        for scanned, dkey in enumerate(keys, 1):
+            self.keys_scanned += 1
+            await self._pace(scanned)
+            if not self.is_ours(dkey):
+                continue
+            keynode = NuCypherNode(dkey)
+            nodes = self.closest_nodes(dkey)
+            # With fewer than k nodes around, nobody took the departed ones' place
+            if len(nodes) < ksize:
+                continue
+            # Each node which left from among the closest was replaced by the
+            # next one out, so the farthest ones are the new holders
+            farthest = nodes[-1].distanceTo(keynode)
+            ids = {n.id for n in nodes}
+            gone = sum(1 for d in departed if d.id not in ids and d.distanceTo(keynode) < farthest)
+            if not gone:
+                continue
+            entrants = nodes[-gone:]
+            value = storage.get(dkey)
+            if value is None or is_rekey_share(value):
+                continue
+            moved.append((dkey, value, entrants))
+            if len(moved) >= self.batch_size:
+                await self._republish(moved)
+                moved = []
+        if moved:
+            await self._republish(moved)
+
+    async def _republish(self, items, refresh=False):
+        by_node = OrderedDict()
+        for dkey, value, nodes in items:
+            for node in nodes:
+                by_node.setdefault(node.id, (node, []))[1].append((dkey, value))
+
+        for node, node_items in by_node.values():
+            await self.server.protocol.callStoreMany(node, node_items)
+            await asyncio.sleep(len(node_items) / self.rate)
+        self.keys_republished += len(items)
+
+        if refresh:
+            # We've just published these, so reset their birthdays. Values
+            # stored again while we were sending are fresh already
+            storage = self.server.storage
+            for dkey, value, _ in items:
+                if storage.get(dkey) == value:
+                    storage[dkey] = value
@@ -1,12 +1,137 @@
-from kademlia.routing import RoutingTable
+import asyncio
+import heapq
+import operator
+from collections import OrderedDict
+
+from kademlia.routing import RoutingTable, TableTraverser
+from nkms.network.capabilities import SeedOnly, prohibits_storage
+from nkms.network.crawling import LookupCache
 
 
 class NuCypherRoutingTable(RoutingTable):
+    # Seconds we leave a node alone for after it said it's overloaded
+    overload_backoff = 30
+    # Departed contacts remembered until the republisher collects them
+    max_departed = 1000
+    # Peers whose version we remember (least recently seen go first)
+    max_versions = 10000
+    # RPCs to a contact which go unanswered in a row before it's dropped
+    max_failures = 3
+
+    def __init__(self, protocol, ksize, node, lookup_cache=None):
+        self.lookup_cache = lookup_cache or LookupCache()
+        super().__init__(protocol, ksize, node)
+
+    def flush(self):
+        super().flush()
+        self.lookup_cache.clear()
+        # node id -> capability bitmask the node announced (see rpc_ping).  Kept apart from
+        # the buckets because contacts often reach us as plain kademlia Nodes, w/o capabilities.
+        # Only contacts in the buckets are in here, so it's no bigger than the table.
+        self.capabilities = {}
+        # node id -> whether the node predates find_storage_node (see callFindStorageNode).
+        # Crawls mostly ask peers which aren't in the buckets, so these aren't either.
+        self.legacy = OrderedDict()
+        # node id -> event loop time until which the node is considered overloaded
+        self.overloaded = {}
+        # node id -> contact which left the table, for RepublishScheduler to move keys off
+        self.departed = OrderedDict()
+        # node id -> RPCs to the contact which went unanswered since it last answered one
+        self.failures = {}
+
+    def remember_capabilities(self, node, capability_mask=None):
+        if self.isNewNode(node):
+            # Not one of our contacts (or only a replacement, which carries its own)
+            return
+        self.capabilities[node.id] = capability_mask if capability_mask is not None else node.capability_mask
 
     def addContact(self, node, seed_only=False):
+        super().addContact(node)
         if seed_only:
             # We want to remember *not* to send values to this node, because it won't remember them.
-            # TODO: What's the simplest upstream-compatible way to accomplish this?
-            return super().addContact(node)
+            self.remember_capabilities(node, SeedOnly.bit)
+        elif getattr(node, 'capability_mask', 0):
+            self.remember_capabilities(node)
+
+    def _remember_version(self, node, legacy):
+        self.legacy.pop(node.id, None)
+        if len(self.legacy) >= self.max_versions:
+            self.legacy.popitem(last=False)
+        self.legacy[node.id] = legacy
+
+    def mark_legacy(self, node):
+        self._remember_version(node, True)
+
+    def mark_current(self, node):
+        self._remember_version(node, False)
+
+    def is_legacy(self, node):
+        return self.legacy.get(node.id) is True
+
+    def is_current(self, node):
+        return self.legacy.get(node.id) is False
+
+    def report_failure(self, node):
+        """
+        Count an unanswered RPC to node.  A lost datagram or two doesn't make
+        a contact leave (and its keys move); max_failures in a row do.
+        """
+        failures = self.failures.get(node.id, 0) + 1
+        if failures < self.max_failures and not self.isNewNode(node):
+            self.failures[node.id] = failures
         else:
-            return super().addContact(node)
+            self.removeContact(node)
+
+    def report_success(self, node):
+        self.failures.pop(node.id, None)
+
+    def removeContact(self, node):
+        if not self.isNewNode(node):
+            self.departed[node.id] = node
+            if len(self.departed) > self.max_departed:
+                # Keys these were close to get republished when they're due anyway
+                self.departed.popitem(last=False)
+        super().removeContact(node)
+        self.capabilities.pop(node.id, None)
+        self.overloaded.pop(node.id, None)
+        self.failures.pop(node.id, None)
+        self.lookup_cache.invalidate(node)
+
+    def can_store(self, node):
+        capability_mask = self.capabilities.get(node.id)
+        if capability_mask is None:
+            # We've never heard from this node directly; assume it's a full node unless it says otherwise.
+            try:
+                return node.can_store()
+            except AttributeError:
+                return True
+        return not prohibits_storage(capability_mask)
+
+    def mark_overloaded(self, node, backoff=None):
+        self.overloaded[node.id] = asyncio.get_event_loop().time() + (backoff or self.overload_backoff)
+
+    def is_overloaded(self, node):
+        until = self.overloaded.get(node.id)
+        if until is None:
+            return False
+        if until < asyncio.get_event_loop().time():
+            del self.overloaded[node.id]
+            return False
+        return True
+
+    def findNeighbors(self, node, k=None, exclude=None, can_store=False):
+        """
+        Same as in kademlia, but if can_store is set only nodes able to store
+        values, and not overloaded at the moment, are returned.
+        """
+        k = k or self.ksize
+        nodes = []
+        for neighbor in TableTraverser(self, node):
+            notexcluded = exclude is None or not neighbor.sameHomeAs(exclude)
+            capable = not can_store or (self.can_store(neighbor) and not self.is_overloaded(neighbor))
+            if neighbor.id != node.id and notexcluded and capable:
+                heapq.heappush(nodes, (node.distanceTo(neighbor), neighbor))
+            if len(nodes) == k:
+                break
+
+        return list(map(operator.itemgetter(1), heapq.nsmallest(k, nodes)))
@@ -1,26 +1,100 @@
 import asyncio
+import heapq
+import os
 import random
+import socket
+from collections import OrderedDict
 
-from kademlia.crawling import NodeSpiderCrawl
+import msgpack
+
+from kademlia.crawling import NodeSpiderCrawl, ValueSpiderCrawl
 from kademlia.network import Server
 from kademlia.node import Node
 from kademlia.utils import digest
 from nkms.network.capabilities import SeedOnly, ServerCapability
+from nkms.network.constants import NODE_IS_BUSY, NODE_IS_OVERLOADED, NODE_STORE_TIMED_OUT
+from nkms.network.crawling import StorageNodeSpiderCrawl
 from nkms.network.node import NuCypherNode
 from nkms.network.protocols import NuCypherSeedOnlyProtocol, NuCypherHashProtocol
+from nkms.network.republish import RepublishScheduler
 from nkms.network.storage import SeedOnlyStorage
+from nkms.network.utils import SingleFlight, ValueCache
 
 
 class NuCypherDHTServer(Server):
     protocol_class = NuCypherHashProtocol
     capabilities = ()
     digests_set = 0
+    store_quorum = 1
+    store_timeout = 5
+    # Seconds between refreshes of the routing table and republishing, or None for never
+    refresh_interval = 3600
 
-    def __init__(self, ksize=20, alpha=3, id=None, storage=None, *args, **kwargs):
-        super().__init__(ksize=20, alpha=3, id=None, storage=None, *args, **kwargs)
+    def __init__(self, ksize=20, alpha=3, id=None, storage=None, reencryption_executor=None,
+                 value_cache_ttl=None, admission_control=None, *args, **kwargs):
+        """
+        :param float value_cache_ttl: If set, values we get() from the network
+            are cached locally for this many seconds
+        :param AdmissionControl admission_control: Rate limits for incoming
+            requests (default: see nkms.network.admission)
+        """
+        super().__init__(ksize=ksize, alpha=alpha, id=id, storage=storage, *args, **kwargs)
         self.node = NuCypherNode(id or digest(random.getrandbits(255)))
+        self.reencryption_executor = reencryption_executor
+        self.admission_control = admission_control
+        self.republisher = RepublishScheduler(self)
+        # Concurrent lookups of the same digest share a single crawl
+        self.gets_in_flight = SingleFlight()
+        self.lookups_in_flight = SingleFlight()
+        self.value_cache = ValueCache(value_cache_ttl) if value_cache_ttl else None
+
+    def _create_protocol(self):
+        return self.protocol_class(self.node, self.storage, self.ksize,
+                                   reencryption_executor=self.reencryption_executor,
+                                   admission_control=self.admission_control)
+
+    def listen(self, port, interface='0.0.0.0', recv_buffer=None, send_buffer=None):
+        """
+        Same as in kademlia, but the socket's receive and send buffers can be
+        enlarged (SO_RCVBUF / SO_SNDBUF, in bytes), so that bursts of datagrams
+        aren't dropped before we get to read them.
+        """
+        super().listen(port, interface)
+        sock = self.transport.get_extra_info('socket')
+        if recv_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+        if send_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+        # The kernel may cap (or on Linux, double) what we asked for
+        self.log.info("Socket buffers: %s bytes to receive, %s to send" % (
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)))
+
+    async def drain(self, timeout=5):
+        """
+        Shut down gracefully: turn away new stores, give the ones being
+        handled and the RPCs we're waiting on up to `timeout` seconds to
+        finish, then stop().
+        """
+        admission_control = self.protocol.admission_control
+        admission_control.draining = True
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while admission_control.stores_in_flight or self.protocol._outstanding:
+            if loop.time() >= deadline:
+                self.log.warning("Stopping with %s stores and %s RPCs unfinished" % (
+                    admission_control.stores_in_flight, len(self.protocol._outstanding)))
+                break
+            await asyncio.sleep(0.05)
+        self.stop()
+
+    @property
+    def lookup_cache(self):
+        return self.protocol.router.lookup_cache
 
     def serialize_capabilities(self):
+        # By name, which every node understands: older ones choke on a bitmask,
+        # and never answer the ping.  (A full node's list is empty anyway.)
         return [ServerCapability.stringify(capability) for capability in self.capabilities]
 
     async def bootstrap_node(self, addr):
@@ -28,40 +102,539 @@ class NuCypherDHTServer(Server):
         Announce node including capabilities
         """
         result = await self.protocol.ping(addr, self.node.id, self.serialize_capabilities())
+        if result[1] == NODE_IS_OVERLOADED:
+            self.log.warning("%s:%s is overloaded, not bootstrapping from it" % addr)
+            return None
         return NuCypherNode(result[1], addr[0], addr[1]) if result[0] else None
 
-    async def set_digest(self, dkey, value):
+    async def store_on_node(self, node, dkey, value, timeout=None):
+        """
+        Store the value on a single node, waiting at most `timeout` seconds.
+
+        Returns a (disposition, value_was_set) tuple, as callStore does.
+        """
+        timeout = timeout or self.store_timeout
+        # Shield the call so that giving up on a slow node doesn't cancel the
+        # rpcudp future; it is still resolved (and the router updated) later.
+        store = asyncio.shield(self.protocol.callStore(node, dkey, value))
+        try:
+            disposition, value_was_set = await asyncio.wait_for(store, timeout)
+        except asyncio.TimeoutError:
+            self.log.warning("storing '%s' on %s timed out" % (dkey.hex(), node))
+            return NODE_STORE_TIMED_OUT, False
+        if value_was_set:
+            self.digests_set += 1
+        return disposition, value_was_set
+
+    async def store_many_on_node(self, node, items, timeout=None):
+        """
+        Store several (dkey, value) pairs on a single node, waiting at most
+        `timeout` seconds.
+
+        Returns a (disposition, [value_was_set for each item]) tuple, as
+        callStoreMany does.
+        """
+        # On top of the time it takes to send them all
+        timeout = (timeout or self.store_timeout) + self.protocol.store_many_duration(len(items))
+        store = asyncio.shield(self.protocol.callStoreMany(node, items))
+        try:
+            disposition, stored = await asyncio.wait_for(store, timeout)
+        except asyncio.TimeoutError:
+            self.log.warning("storing %s items on %s timed out" % (len(items), node))
+            return NODE_STORE_TIMED_OUT, [False] * len(items)
+        self.digests_set += sum(stored)
+        return disposition, stored
+
+    def save_routing_table(self, fname):
+        """
+        Save our id and every contact in the routing table, with its
+        capabilities, so that after a restart warm_bootstrap() can get this
+        node going again with one round of pings.
+        """
+        router = self.protocol.router
+        contacts = [[n.id, n.ip, n.port, router.capabilities.get(n.id, getattr(n, 'capability_mask', 0))]
+                    for bucket in router.buckets for n in bucket.getNodes()]
+        if not contacts:
+            self.log.warning("No known contacts, so not writing routing table to %s" % fname)
+            return
+        self.log.info("Saving %s contacts to %s" % (len(contacts), fname))
+        # Write and rename, so a crash never leaves a truncated snapshot behind
+        with open(fname + '.tmp', 'wb') as f:
+            f.write(msgpack.dumps([self.node.id, contacts], use_bin_type=True))
+        os.replace(fname + '.tmp', fname)
+
+    def save_routing_table_regularly(self, fname, frequency=600):
+        """
+        Save the routing table to fname every `frequency` seconds.
+        """
+        self.save_routing_table(fname)
+        loop = asyncio.get_event_loop()
+        self.save_state_loop = loop.call_later(frequency, self.save_routing_table_regularly, fname, frequency)
+
+    @staticmethod
+    def load_routing_table(fname):
+        """
+        :return: The node id and the contacts saved by save_routing_table()
+        :rtype: tuple of bytes and a list of NuCypherNodes
+        """
+        with open(fname, 'rb') as f:
+            node_id, contacts = msgpack.loads(f.read(), raw=False)
+        return node_id, [NuCypherNode(id, ip, port, capability_mask=mask) for id, ip, port, mask in contacts]
+
+    async def warm_bootstrap(self, fname, seeds=(), max_concurrency=64):
+        """
+        Bootstrap from a routing table saved by save_routing_table(), plus any
+        seeds, by pinging all of them at once (at most max_concurrency at a
+        time).  Everyone who answers goes straight into the routing table,
+        with the capabilities we remember, so there's no crawl to wait for.
+        If nobody answers, fall back to an ordinary bootstrap off the seeds.
+
+        :return: The nodes which answered
+        :rtype: list
+        """
+        contacts = self.load_routing_table(fname)[1] if os.path.exists(fname) else []
+        remembered = {(n.ip, n.port): n for n in contacts}
+        addrs = list(remembered) + [tuple(addr) for addr in seeds if tuple(addr) not in remembered]
+        self.log.debug("Warm bootstrap with %s saved contacts and %s seeds" % (len(contacts), len(addrs) - len(contacts)))
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def ping(addr):
+            async with semaphore:
+                return await self.bootstrap_node(addr)
+
+        router = self.protocol.router
+        nodes = []
+        for addr, node in zip(addrs, await asyncio.gather(*map(ping, addrs))):
+            if node is None or node.id == self.node.id:
+                continue
+            if addr in remembered and remembered[addr].id == node.id:
+                node = remembered[addr]
+            router.addContact(node)
+            nodes.append(node)
+
+        if not nodes and seeds:
+            self.log.warning("None of the saved contacts answered, bootstrapping from seeds")
+            return await self.bootstrap(seeds)
+        return nodes
+
+    async def get(self, key):
+        """
+        Get a key if the network has it.  Concurrent gets of the same key
+        share one crawl, and a recent crawl of the same region of the keyspace,
+        if any, is where that crawl starts.
+
+        Returns None if not found, the value otherwise.
+        """
+        dkey = digest(key)
+        # if this node has it, return it
+        if self.storage.get(dkey) is not None:
+            return self.storage.get(dkey)
+        if self.value_cache is not None:
+            value = self.value_cache.get(dkey)
+            if value is not None:
+                return value
+        return await self.gets_in_flight.run(dkey, self._get_digest, dkey)
+
+    async def _get_digest(self, dkey):
+        generation = self.value_cache.generation(dkey) if self.value_cache is not None else None
+        node = self.node_class(dkey)
+        nearest = self.lookup_cache.peek(node, self.ksize) or self.protocol.router.findNeighbors(node)
+        if len(nearest) == 0:
+            self.log.warning("There are no known neighbors to get key %s" % dkey.hex())
+            return None
+        spider = ValueSpiderCrawl(self.protocol, node, nearest, self.ksize, self.alpha)
+        value = await spider.find()
+        if value is not None and self.value_cache is not None:
+            # Unless we've set dkey in the meantime
+            self.value_cache.put(dkey, value, generation)
+        return value
+
+    def forget_value(self, dkey, value=None):
+        """
+        Drop what we know about dkey's value: its cached value, and the gets
+        of it under way, which could still find the old one.  If value is
+        given, it's cached instead.
+        """
+        self.gets_in_flight.forget(dkey)
+        if self.value_cache is not None:
+            self.value_cache.invalidate(dkey)
+            if value is not None:
+                self.value_cache.put(dkey, value)
+
+    def replica_candidates(self, dkey, nodes):
+        """
+        Nodes on one host may share their storage (see
+        entry_points/run_local_server.py), so storing a value on two of them
+        makes one replica, not two.  Only the closest node on each host is
+        kept, and those dropped are made up for from the routing table.
+
+        :param list nodes: The nearest storage nodes to dkey, closest first
+        :return: Nodes on distinct hosts, closest first: the first len(nodes)
+            ones to store on, followed by spares
+        """
+        neighbors = self.protocol.router.findNeighbors(self.node_class(dkey), 2 * self.ksize, can_store=True)
+        seen, hosts, candidates = {self.node.id}, set(), []
+        for n in nodes + neighbors:
+            if n.id in seen or n.ip in hosts:
+                continue
+            seen.add(n.id)
+            hosts.add(n.ip)
+            candidates.append(n)
+        return candidates
+
+    async def set_digest(self, dkey, value, quorum=None, timeout=None, outcomes=None):
         """
         Set the given SHA1 digest key (bytes) to the given value in the network.
 
-        Returns True if a digest was in fact set.
+        Stores are sent to all the nearest nodes at once, one per host (see
+        replica_candidates).  As soon as `quorum` of them succeed we return,
+        and the rest finish in the background.  Until then, each node which
+        says it's overloaded is replaced by the next closest storage node we
+        know of on another host.
+
+        :param int quorum: Successful stores to wait for (default: store_quorum)
+        :param float timeout: Seconds to wait for each node (default: store_timeout)
+        :param dict outcomes: If given, filled with
+            node id -> (disposition, value_was_set) as each store completes,
+            including the ones which complete after we've returned
+
+        Returns True if a digest was in fact set on at least `quorum` nodes.
         """
+        quorum = quorum or self.store_quorum
+        if outcomes is None:
+            outcomes = {}
+        self.forget_value(dkey)
         node = self.node_class(dkey)
 
-        nearest = self.protocol.router.findNeighbors(node)
-        if len(nearest) == 0:
-            self.log.warning("There are no known neighbors to set key %s" % dkey.hex())
+        nodes = await self.find_storage_nodes(dkey)
+        if len(nodes) == 0:
+            self.log.warning("There are no storage nodes to set key %s" % dkey.hex())
             return False
-
-        spider = NodeSpiderCrawl(self.protocol, node, nearest, self.ksize, self.alpha)
-        nodes = await spider.find()
         self.log.info("setting '%s' on %s" % (dkey.hex(), list(map(str, nodes))))
 
         # if this node is close too, then store here as well
         if self.node.distanceTo(node) < max([n.distanceTo(node) for n in nodes]):
             self.storage[dkey] = value
-        ds = []
-        for n in nodes:
-            if self.node.id == n.id:
-                # TOOD: Consider whether to store stuff locally.  We don't really know yet.  Probably at least some things.
-                ds.append(False)
-            else:
-                disposition, value_was_set = await self.protocol.callStore(n, dkey, value)
+
+        def record_outcome(node_id):
+            return lambda store: outcomes.__setitem__(node_id, store.result())
+
+        def start_store(n):
+            store = asyncio.ensure_future(self.store_on_node(n, dkey, value, timeout))
+            store.add_done_callback(record_outcome(n.id))
+            return store
+
+        candidates = self.replica_candidates(dkey, nodes)
+        pending = set(map(start_store, candidates[:len(nodes)]))
+        spares = iter(candidates[len(nodes):])
+
+        succeeded = 0
+        while pending and succeeded < quorum:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for store in done:
+                disposition, value_was_set = store.result()
                 if value_was_set:
-                    self.digests_set += 1
-                ds.append(value_was_set)
-        # return true only if at least one store call succeeded
-        return any(ds)
+                    succeeded += 1
+                elif disposition == NODE_IS_OVERLOADED:
+                    spare = next(spares, None)
+                    if spare is not None:
+                        pending.add(start_store(spare))
+
+        if pending:
+            self.log.debug("quorum of %s reached for '%s', %s stores still in flight" % (
+                quorum, dkey.hex(), len(pending)))
+        # Gets started while we were storing may have found the old value
+        self.forget_value(dkey, value if succeeded >= quorum else None)
+        return succeeded >= quorum
+
+    async def set_digests(self, items, quorum=None, timeout=None):
+        """
+        Set many digests at once.  Each node gets all the values it's among
+        the nearest nodes for in one store_many, so this costs a round trip
+        per node rather than per value.  As in set_digest, each value goes to
+        one node per host, and the values a node turns away as overloaded go
+        to the next closest storage node on another host instead, until each
+        of them is on `quorum` nodes.
+
+        :param dict items: SHA1 digest key (bytes) -> value
+        :param int quorum: Nodes each value must be stored on (default: store_quorum)
+        :param float timeout: Seconds to wait for each node (default: store_timeout)
+
+        :return: dkey -> whether the value was set on at least `quorum` nodes
+        :rtype: dict
+        """
+        quorum = quorum or self.store_quorum
+        dkeys = list(items)
+        for dkey in dkeys:
+            self.forget_value(dkey)
+
+        all_nodes = await self.find_storage_nodes_many(dkeys)
+        by_node = OrderedDict()
+        spares = {}
+        for dkey, nodes in all_nodes.items():
+            if len(nodes) == 0:
+                self.log.warning("There are no storage nodes to set key %s" % dkey.hex())
+                continue
+            # if this node is close too, then store here as well
+            key_node = self.node_class(dkey)
+            if self.node.distanceTo(key_node) < max([n.distanceTo(key_node) for n in nodes]):
+                self.storage[dkey] = items[dkey]
+            candidates = self.replica_candidates(dkey, nodes)
+            for n in candidates[:len(nodes)]:
+                by_node.setdefault(n.id, (n, []))[1].append((dkey, items[dkey]))
+            spares[dkey] = iter(candidates[len(nodes):])
+        self.log.info("setting %s keys on %s nodes" % (len(dkeys), len(by_node)))
+
+        succeeded = dict.fromkeys(dkeys, 0)
+        targets = list(by_node.values())
+        while targets:
+            results = await asyncio.gather(*[self.store_many_on_node(n, node_items, timeout)
+                                             for n, node_items in targets])
+            turned_away = []
+            for (_, node_items), (disposition, stored) in zip(targets, results):
+                for (dkey, value), value_was_set in zip(node_items, stored):
+                    if value_was_set:
+                        succeeded[dkey] += 1
+                    elif disposition == NODE_IS_OVERLOADED:
+                        turned_away.append((dkey, value))
+
+            by_node = OrderedDict()
+            for dkey, value in turned_away:
+                if succeeded[dkey] >= quorum:
+                    continue
+                spare = next(spares[dkey], None)
+                if spare is not None:
+                    by_node.setdefault(spare.id, (spare, []))[1].append((dkey, value))
+            targets = list(by_node.values())
+
+        for dkey, count in succeeded.items():
+            self.forget_value(dkey, items[dkey] if count >= quorum else None)
+        return {dkey: count >= quorum for dkey, count in succeeded.items()}
+
+    def refresh_table(self):
+        """
+        Same as in kademlia, every refresh_interval seconds.  With several
+        servers sharing one storage, each of them should republish only its
+        share of the keys (see RepublishScheduler.shared_with).
+        """
+        if self.refresh_interval is None:
+            return
+        self.log.debug("Refreshing routing table")
+        asyncio.ensure_future(self._refresh_table())
+        loop = asyncio.get_event_loop()
+        self.refresh_loop = loop.call_later(self.refresh_interval, self.refresh_table)
+
+    async def _refresh_table(self):
+        """
+        Refresh lonely buckets and republish values, as kademlia does,
+        except that values are republished incrementally (see RepublishScheduler).
+        """
+        ds = []
+        for node_id in self.protocol.getRefreshIDs():
+            node = self.node_class(node_id)
+            nearest = self.protocol.router.findNeighbors(node, self.alpha)
+            spider = NodeSpiderCrawl(self.protocol, node, nearest, self.ksize, self.alpha)
+            ds.append(spider.find())
+        await asyncio.gather(*ds)
+
+        await self.republisher.run()
+
+    async def find_storage_nodes(self, dkey):
+        """
+        Crawl the network for the k nodes closest to dkey which can store values.
+
+        This node itself is never among them.  Concurrent lookups of the same
+        dkey share one crawl.
+
+        :return: Nodes ordered by their distance to dkey
+        :rtype: list
+        """
+        return await self.lookups_in_flight.run(dkey, self._find_storage_nodes, dkey)
+
+    async def _find_storage_nodes(self, dkey):
+        node = self.node_class(dkey)
+        nodes = self.lookup_cache.get(node, self.ksize)
+        if nodes is not None:
+            return [n for n in nodes if n.id != self.node.id]
+
+        nearest = self.protocol.router.findNeighbors(node, can_store=True)
+        if len(nearest) == 0:
+            self.log.warning("There are no known storage neighbors for key %s" % dkey.hex())
+            return []
+        spider = StorageNodeSpiderCrawl(self.protocol, node, nearest, self.ksize, self.alpha)
+        nodes = await spider.find()
+        self.lookup_cache.put(node, nodes, spider.hops, spider.rpcs)
+        # TOOD: Consider whether to store stuff locally.  We don't really know yet.  Probably at least some things.
+        return [n for n in nodes if n.id != self.node.id]
+
+    async def find_storage_nodes_many(self, dkeys):
+        """
+        find_storage_nodes for many keys at once, w/o crawling for each of
+        them.  Every node in the subtree of the keyspace around a key which
+        is just short of the farthest of its k closest nodes is among them.
+        Other keys well inside that subtree (in the half of it around the
+        key) get their closest nodes from the ones found so far instead of a
+        crawl, much as LookupCache results do for keys sharing a prefix.
+        Keys far enough apart are crawled for at once, going by our routing
+        table (which knows fewer nodes, so overestimates subtrees), until
+        every key is served.
+
+        :return: dkey -> nodes ordered by their distance to dkey
+        :rtype: dict
+        """
+        found = OrderedDict((dkey, None) for dkey in sorted(dkeys))
+        subtrees = {}  # height -> set of key >> height for the keys crawled for
+        known = {}  # node id -> node, from every crawl
+        router = self.protocol.router
+
+        def subtree(dkey, nodes):
+            farthest = max([n.distanceTo(self.node_class(dkey)) for n in nodes], default=0)
+            height = max(farthest.bit_length() - 2, 0)
+            return height, int.from_bytes(dkey, byteorder='big') >> height
+
+        def crawled_nearby(dkey):
+            key = int.from_bytes(dkey, byteorder='big')
+            return any(key >> height in prefixes for height, prefixes in subtrees.items())
+
+        while True:
+            pending = [dkey for dkey, nodes in found.items() if nodes is None]
+            if not pending:
+                return found
+            to_crawl, estimated = [], set()
+            for dkey in pending:
+                key = int.from_bytes(dkey, byteorder='big')
+                if any(key >> height == prefix for height, prefix in estimated):
+                    continue
+                to_crawl.append(dkey)
+                estimated.add(subtree(dkey, router.findNeighbors(self.node_class(dkey), can_store=True)))
+            all_nodes = await asyncio.gather(*map(self.find_storage_nodes, to_crawl))
+            for dkey, nodes in zip(to_crawl, all_nodes):
+                found[dkey] = nodes
+                if nodes:
+                    height, prefix = subtree(dkey, nodes)
+                    subtrees.setdefault(height, set()).add(prefix)
+                    known.update((n.id, n) for n in nodes)
+            for dkey in pending:
+                if found[dkey] is None and crawled_nearby(dkey):
+                    key_node = self.node_class(dkey)
+                    found[dkey] = heapq.nsmallest(self.ksize, known.values(), key=key_node.distanceTo)
+
+    async def store_rekey_shares(self, dkey, shares, algorithm, timeout=None):
+        """
+        Store n shares of an m-of-n rekey on the n closest storage nodes, one
+        share per node and without replicating any of them.
+
+        :param bytes dkey: ID of the rekey
+        :param list shares: The n rekey shares
+        :param dict algorithm: Parameters of the re-encryption algo
+
+        Returns True if every share was stored.
+        """
+        nodes = await self.find_storage_nodes(dkey)
+        if len(nodes) < len(shares):
+            self.log.warning("only %s nodes available for %s shares of %s" % (
+                len(nodes), len(shares), dkey.hex()))
+            return False
+
+        stores = [self.store_on_node(n, dkey, {b'rk': share, b'algorithm': algorithm, b'share': i}, timeout)
+                  for i, (n, share) in enumerate(zip(nodes, shares))]
+        results = await asyncio.gather(*stores)
+        return all(value_was_set for _, value_was_set in results)
+
+    async def reencrypt_on_node(self, node, dkey, ekey, timeout=None):
+        """
+        Ask a single node to re-encrypt ekey with the rekey (share) it holds.
+
+        Returns a [share index, re-encrypted ekey] pair, or None on failure.
+        """
+        timeout = timeout or self.store_timeout
+        reencryption = asyncio.shield(self.protocol.callReencrypt(node, dkey, ekey))
+        try:
+            response_received, piece = await asyncio.wait_for(reencryption, timeout)
+        except asyncio.TimeoutError:
+            self.log.warning("re-encryption of '%s' on %s timed out" % (dkey.hex(), node))
+            return None
+        if piece == NODE_IS_BUSY:
+            self.log.info("%s is too busy to re-encrypt '%s'" % (node, dkey.hex()))
+            return None
+        return piece if response_received else None
+
+    async def reencrypt_many_on_node(self, node, dkey, ekeys, timeout=None):
+        """
+        Ask a single node to re-encrypt all of ekeys with the rekey (share) it
+        holds.
+
+        Returns a [share index, [re-encrypted ekeys]] pair, or None on failure.
+        """
+        timeout = timeout or self.store_timeout
+        reencryption = asyncio.shield(self.protocol.callReencryptMany(node, dkey, ekeys))
+        try:
+            response_received, pieces = await asyncio.wait_for(reencryption, timeout)
+        except asyncio.TimeoutError:
+            self.log.warning("re-encryption of %s ekeys with '%s' on %s timed out" % (
+                len(ekeys), dkey.hex(), node))
+            return None
+        if pieces == NODE_IS_BUSY:
+            self.log.info("%s is too busy to re-encrypt with '%s'" % (node, dkey.hex()))
+            return None
+        return pieces if response_received else None
+
+    async def reencrypt_digest_many(self, dkey, ekeys, m=1, timeout=None):
+        """
+        Same as reencrypt_digest, for many ekeys at once: each share holder is
+        asked to re-encrypt all of them in one go.
+
+        :return: For each ekey, m [share index, re-encrypted ekey] pairs sorted
+            by index, or None if fewer than m share holders answered
+        :rtype: list
+        """
+        if not ekeys:
+            return []
+        nodes = await self.find_storage_nodes(dkey)
+        pending = {asyncio.ensure_future(self.reencrypt_many_on_node(n, dkey, ekeys, timeout)) for n in nodes}
+
+        answers = []
+        while pending and len(answers) < m:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            answers.extend(d.result() for d in done if d.result() is not None)
+
+        for reencryption in pending:
+            reencryption.cancel()
+
+        if len(answers) < m:
+            self.log.warning("only %s of %s re-encryptions with '%s' succeeded" % (len(answers), m, dkey.hex()))
+            return None
+        answers = sorted(answers[:m], key=lambda answer: answer[0] or 0)
+        return [[[share, reencrypted[i]] for share, reencrypted in answers] for i in range(len(ekeys))]
+
+    async def reencrypt_digest(self, dkey, ekey, m=1, timeout=None):
+        """
+        Re-encrypt ekey with an m-of-n rekey stored under dkey.
+
+        All of the closest nodes are asked at once, and we return as soon as m
+        of them have answered, so slow or dead share holders never hold up
+        decryption.  The pieces are combined by the PRE algorithm on decrypt.
+
+        :return: m [share index, re-encrypted ekey] pairs sorted by index, or
+            None if fewer than m share holders answered
+        :rtype: list
+        """
+        nodes = await self.find_storage_nodes(dkey)
+        pending = {asyncio.ensure_future(self.reencrypt_on_node(n, dkey, ekey, timeout)) for n in nodes}
+
+        pieces = []
+        while pending and len(pieces) < m:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pieces.extend(d.result() for d in done if d.result() is not None)
+
+        for reencryption in pending:
+            reencryption.cancel()
+
+        if len(pieces) < m:
+            self.log.warning("only %s of %s re-encryptions of '%s' succeeded" % (len(pieces), m, dkey.hex()))
+            return None
+        return sorted(pieces[:m], key=lambda piece: piece[0] or 0)
 
 
 class NuCypherSeedOnlyDHTServer(NuCypherDHTServer):
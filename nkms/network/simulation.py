@@ -0,0 +1,106 @@
+import asyncio
+import random
+
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    """
+    An event loop on a simulated clock. Whenever nothing is ready to run, the
+    clock jumps straight to the next scheduled callback, so latencies and
+    timeouts cost no real time at all.  Cache TTLs, backoffs and rate limits
+    go by the loop's clock as well.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._now = 0.0
+
+    def time(self):
+        return self._now
+
+    def _run_once(self):
+        if not self._ready and self._scheduled:
+            self._now = max(self._now, self._scheduled[0]._when)
+        super()._run_once()
+
+
+class SimulatedTransport(asyncio.DatagramTransport):
+
+    def __init__(self, network, address):
+        super().__init__()
+        self.network = network
+        self.address = address
+
+    def sendto(self, data, addr=None):
+        self.network.send(data, self.address, tuple(addr))
+
+    def get_extra_info(self, name, default=None):
+        return self.address if name == 'sockname' else default
+
+    def close(self):
+        self.network.endpoints.pop(self.address, None)
+
+
+class SimulatedNetwork(object):
+    """
+    An in-memory stand-in for UDP, so that thousands of nodes can run in one
+    process (see benchmarks/dht_simulation.py).
+
+    Every datagram is delivered after `latency` seconds (+/- `jitter`) of
+    simulated time, unless it is lost (with probability `loss`) or nobody
+    listens at its destination.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, loss=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.endpoints = {}
+        self.messages = 0
+        self.dropped = 0
+
+    def next_address(self):
+        n = len(self.endpoints) + 1
+        return ('10.%s.%s.%s' % (n >> 16 & 255, n >> 8 & 255, n & 255), 8468)
+
+    def listen(self, server, address=None):
+        """
+        Attach a server (e.g. a NuCypherDHTServer) to the network, in place of
+        server.listen(). Unlike there, the routing table isn't refreshed.
+        """
+        address = address or self.next_address()
+        protocol = server._create_protocol()
+        transport = SimulatedTransport(self, address)
+        protocol.connection_made(transport)
+        server.transport, server.protocol = transport, protocol
+        self.endpoints[address] = protocol
+        return address
+
+    def send(self, data, source, destination):
+        self.messages += 1
+        protocol = self.endpoints.get(destination)
+        if protocol is None or self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency
+        if self.jitter:
+            delay = max(0, self.random.uniform(delay - self.jitter, delay + self.jitter))
+        asyncio.get_event_loop().call_later(delay, protocol.datagram_received, data, source)
+
+    async def spawn(self, server_class, count, seeds=3, **kwargs):
+        """
+        Start `count` servers and bootstrap each of them off up to `seeds`
+        random nodes which are already on the network.
+
+        :return: The servers
+        :rtype: list
+        """
+        servers = []
+        for _ in range(count):
+            known = list(self.endpoints)
+            server = server_class(**kwargs)
+            self.listen(server)
+            if known:
+                await server.bootstrap(self.random.sample(known, min(seeds, len(known))))
+            servers.append(server)
+        return servers
@@ -1,7 +1,136 @@
-from kademlia.storage import ForgetfulStorage
+import os.path
+import time
+
+import appdirs
+import msgpack
+from kademlia.storage import ForgetfulStorage, IStorage
+from nkms.db import CONFIG_APPNAME, DB
+
+DHT_DB_NAME = 'dht-db'
 
 
 class SeedOnlyStorage(ForgetfulStorage):
 
     def __setitem__(self, key, value):
-        pass
\ No newline at end of file
+        pass
+
+
+class LMDBStorage(IStorage):
+    """
+    Persistent storage for full DHT nodes, on top of nkms.db.DB.
+
+    Values live in one LMDB database and a (birthday, key) index in another,
+    so republishing and culling are cursor scans from the oldest entry
+    rather than walks over everything in memory. Nothing but the current
+    page of a scan is held in RAM, so a node can hold more than fits there.
+    """
+    PAGE_SIZE = 1000
+
+    def __init__(self, path=None, ttl=604800, map_size=2 ** 40):
+        """
+        :param str path: Where the LMDB environment lives
+        :param int ttl: Max age of a value in seconds (default: a week)
+        :param int map_size: Max size of the environment in bytes
+        """
+        path = path or os.path.join(
+                appdirs.user_data_dir(CONFIG_APPNAME), DHT_DB_NAME)
+        self._db = DB(path, max_dbs=2, map_size=map_size)
+        self.env = self._db.db
+        self.values = self.env.open_db(b'values')
+        self.birthdays = self.env.open_db(b'birthdays')
+        self.ttl = ttl
+
+    @staticmethod
+    def _birthday_key(birthday, key):
+        return birthday.to_bytes(8, byteorder='big') + key
+
+    def __setitem__(self, key, value):
+        birthday = int(time.time() * 1000000)
+        with self.env.begin(write=True) as tx:
+            previous = tx.get(key, db=self.values)
+            if previous is not None:
+                previous_birthday, _ = msgpack.loads(previous, raw=False)
+                tx.delete(self._birthday_key(previous_birthday, key), db=self.birthdays)
+            tx.put(key, msgpack.dumps([birthday, value], use_bin_type=True), db=self.values)
+            tx.put(self._birthday_key(birthday, key), b'', db=self.birthdays)
+        self.cull()
+
+    def cull(self):
+        """
+        Drop values older than the ttl. Stops at the first fresh value.
+        """
+        stop = self._birthday_key(int((time.time() - self.ttl) * 1000000) + 1, b'')
+        with self.env.begin(write=True) as tx:
+            cursor = tx.cursor(db=self.birthdays)
+            while cursor.first() and cursor.key() < stop:
+                tx.delete(cursor.key()[8:], db=self.values)
+                cursor.delete()
+
+    def _get(self, key):
+        with self.env.begin(db=self.values) as tx:
+            stored = tx.get(key)
+        if stored is None:
+            return None
+        birthday, value = msgpack.loads(stored, raw=False)
+        if birthday <= (time.time() - self.ttl) * 1000000:
+            return None
+        return [value]
+
+    def get(self, key, default=None):
+        stored = self._get(key)
+        return default if stored is None else stored[0]
+
+    def __getitem__(self, key):
+        stored = self._get(key)
+        if stored is None:
+            raise KeyError(key)
+        return stored[0]
+
+    def _scan(self, db, stop=None):
+        """
+        Yield (key, raw value) pairs of db in key order, below stop, reading a
+        page at a time so that no transaction stays open between pages.
+        """
+        last = None
+        while True:
+            with self.env.begin(db=db) as tx:
+                cursor = tx.cursor()
+                if not cursor.set_range(last or b''):
+                    return
+                if cursor.key() == last and not cursor.next():
+                    return
+                page = []
+                for k, v in cursor.iternext():
+                    if stop is not None and k >= stop:
+                        break
+                    page.append((k, v))
+                    if len(page) == self.PAGE_SIZE:
+                        break
+            if not page:
+                return
+            yield from page
+            if len(page) < self.PAGE_SIZE:
+                return
+            last = page[-1][0]
+
+    def iteritemsOlderThan(self, secondsOld):
+        stop = self._birthday_key(int((time.time() - secondsOld) * 1000000) + 1, b'')
+        for birthday_key, _ in self._scan(self.birthdays, stop=stop):
+            key = birthday_key[8:]
+            value = self.get(key)
+            if value is not None:
+                yield key, value
+
+    def items(self):
+        for key, stored in self._scan(self.values):
+            yield key, msgpack.loads(stored, raw=False)[1]
+
+    def __iter__(self):
+        for key, _ in self._scan(self.values):
+            yield key
+
+    def __repr__(self):
+        return '<LMDBStorage %s>' % self._db.path
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,89 @@
+import asyncio
+from collections import OrderedDict
+
+
+class SingleFlight(object):
+    """
+    Lets concurrent callers asking for the same key share one call in flight,
+    rather than each of them making it.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.coalesced = 0
+
+    async def run(self, key, coroutine_function, *args):
+        """
+        Await coroutine_function(*args), or the call already made for key.
+        """
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coroutine_function(*args))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.coalesced += 1
+        # A caller giving up mustn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def forget(self, key):
+        """
+        Leave the call in flight for key to the callers already waiting on
+        it; later ones make a new call.
+        """
+        self.in_flight.pop(key, None)
+
+    def _done(self, key, future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+
+
+class ValueCache(object):
+    """
+    A small local cache of values, each kept for `ttl` seconds.
+
+    Every invalidation of a key starts a new generation of it.  A lookup
+    which started before the latest one passes the generation it started
+    in to put(), and its (possibly outdated) value is dropped.
+    """
+
+    def __init__(self, ttl=5, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires, value)
+        # key -> generation, for the keys invalidated last.  A key which isn't
+        # in here is in the newest generation evicted from it, or an older one.
+        self.generations = OrderedDict()
+        self.last_generation = 0
+        self.evicted_generation = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < asyncio.get_event_loop().time():
+            del self.entries[key]
+            return None
+        return entry[1]
+
+    def generation(self, key):
+        return self.generations.get(key, self.evicted_generation)
+
+    def put(self, key, value, generation=None):
+        """
+        Cache value, unless key was invalidated since `generation`.
+        """
+        if generation is not None and generation != self.generation(key):
+            return
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.max_entries:
+            self.entries.popitem(last=False)
+        self.entries[key] = (asyncio.get_event_loop().time() + self.ttl, value)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+        self.last_generation += 1
+        self.generations.pop(key, None)
+        if len(self.generations) >= self.max_entries:
+            self.evicted_generation = self.generations.popitem(last=False)[1]
+        self.generations[key] = self.last_generation
@@ -0,0 +1,42 @@
+from nkms.network.admission import AdmissionControl, TokenBucket
+
+
+def test_token_bucket_allows_bursts_up_to_its_size():
+    bucket = TokenBucket(rate=0, burst=3)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+    bucket = TokenBucket(rate=1000, burst=1)
+    assert bucket.take()
+    bucket.updated -= 1
+    assert bucket.take()
+
+
+def test_peers_are_rate_limited_separately():
+    admission = AdmissionControl(store_rate=0, store_burst=2, ping_rate=0, ping_burst=1)
+    alice, bob = ('10.0.0.1', 8468), ('10.0.0.2', 8468)
+
+    assert admission.admit('store', alice)
+    assert admission.admit('store', alice)
+    assert not admission.admit('store', alice)
+    assert admission.admit('store', bob)
+
+    # Each RPC has its own limit, and the rest aren't limited at all.
+    assert admission.admit('ping', alice)
+    assert not admission.admit('ping', alice)
+    assert all(admission.admit('find_node', alice) for _ in range(100))
+    assert admission.rejected == 2
+
+
+def test_concurrent_stores_are_capped_across_peers():
+    class Request(object):
+        def add_done_callback(self, callback):
+            self.done = lambda: callback(self)
+
+    admission = AdmissionControl(max_concurrent_stores=1)
+    request = Request()
+    assert admission.admit('store', ('10.0.0.1', 8468))
+    admission.track_store(request)
+    assert not admission.admit('store', ('10.0.0.2', 8468))
+
+    request.done()
+    assert admission.admit('store', ('10.0.0.2', 8468))
@@ -1,3 +1,4 @@
+import threading
 import unittest
 import msgpack
 from nacl.utils import random
@@ -148,3 +149,79 @@ class TestClient(unittest.TestCase):
 
         dec_data = self.client.decrypt_bulk(enc_data, key)
         self.assertEqual(test_data, dec_data)
+
+    def test_shared_between_threads(self):
+        errors = []
+        pres = {}
+
+        def work(i):
+            try:
+                path = b'/foo/bar/%d' % i
+                for _ in range(20):
+                    key = random(32)
+                    enc_keys = self.client.encrypt_key(key, path=path)
+                    self.assertEqual(key, self.client.decrypt_key(enc_keys[-1], path=path))
+                pres[i] = self.client._pre
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        # Each thread had a PRE instance of its own
+        self.assertEqual(8, len({id(pre) for pre in pres.values()}))
+
+    def test_decrypt_with_data_key_cache(self):
+        client = Client(data_key_cache_ttl=60)
+        edata = client.encrypt(b'hello world!')
+
+        self.assertEqual(b'hello world!', client.decrypt(edata))
+        self.assertEqual(1, len(client._data_keys.entries))
+
+        # The second time around, there's no PRE decryption
+        client.decrypt_key = None
+        self.assertEqual(b'hello world!', client.decrypt(edata))
+        self.assertEqual(1, client._data_keys.hits)
+
+        client.purge_data_keys()
+        self.assertEqual(0, len(client._data_keys.entries))
+
+    def test_decrypt_with_path_and_data_key_cache(self):
+        client = Client(data_key_cache_ttl=60)
+        edata = client.encrypt(b'hello world!', path=b'/foo/bar')
+
+        self.assertEqual(b'hello world!', client.decrypt(edata, path=b'/foo/bar'))
+
+        # Only the key for the full path is cached, and no subpath's key is
+        # decrypted to get to it
+        client.decrypt_key = None
+        self.assertEqual(b'hello world!', client.decrypt(edata, path=b'/foo/bar'))
+        self.assertEqual(1, client._data_keys.hits)
+
+    def test_build_and_read_header_with_codec(self):
+        enc_keys = [random(148), random(148)]
+        header, length = self.client._build_header(enc_keys, version=101, codec_id=2)
+
+        version, read_keys, codec_id = self.client._read_header(header)
+        self.assertEqual(101, version)
+        self.assertEqual(enc_keys, read_keys)
+        self.assertEqual(2, codec_id)
+
+    def test_encrypt_compressed(self):
+        data = b'{"llamas": "tons_of_things_keyed_llamas"}\n' * 1000
+        plain = self.client.encrypt(data)
+        compressed = self.client.encrypt(data, compression='zlib')
+        self.assertLess(len(compressed), len(plain) // 5)
+        self.assertEqual(data, self.client.decrypt(compressed))
+
+        # Incompressible data goes in as it is, with an ordinary header
+        data = random(100000)
+        edata = self.client.encrypt(data, algorithm=dict(default_algorithm, compression=dict(codec='lzma')))
+        header_length = int.from_bytes(edata[:4], byteorder='big')
+        version, _, codec_id = self.client._read_header(edata[4:4 + header_length])
+        self.assertEqual((100, 0), (version, codec_id))
+        self.assertEqual(data, self.client.decrypt(edata))
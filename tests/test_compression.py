@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from nkms.crypto import compression
+
+
+def test_compress_roundtrip():
+    data = b'timestamp,level,message\n' + b'1500000000,INFO,all is well\n' * 10000
+    for codec in ('zlib', 'lzma', 'bz2'):
+        codec_id, compressed = compression.compress(data, codec)
+        assert codec_id != 0
+        assert len(compressed) < len(data) // 5
+        assert compression.decompress(compressed, codec_id) == data
+
+
+def test_incompressible_data_is_left_alone():
+    # Large enough that only a sample of it is tried
+    data = os.urandom(compression.SAMPLE_SIZE * 4)
+    assert compression.compress(data, 'zlib') == (0, data)
+    assert compression.decompress(data, 0) == data
+
+
+def test_codec_ids_are_unique():
+    with pytest.raises(ValueError):
+        compression.register_codec(1, 'zlib-again', None, None)
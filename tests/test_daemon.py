@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import pytest
+
+from nkms.crypto import default_algorithm, pre_from_algorithm
+from nkms.network import daemon
+
+
+@pytest.fixture
+def daemon_client(tmpdir):
+    socket_path = str(tmpdir.join('daemon.sock'))
+    event_loop = asyncio.new_event_loop()
+    reencryption_daemon = daemon.ReencryptionDaemon(socket_path, str(tmpdir.join('db')))
+    event_loop.run_until_complete(reencryption_daemon.start())
+    thread = threading.Thread(target=event_loop.run_forever)
+    thread.start()
+
+    client = daemon.Client(socket_path)
+    yield client
+
+    client.close()
+    event_loop.call_soon_threadsafe(event_loop.stop)
+    thread.join()
+    event_loop.run_until_complete(reencryption_daemon.stop())
+    event_loop.close()
+
+
+def test_daemon_reencrypts_pipelined_requests(daemon_client):
+    pre = pre_from_algorithm(default_algorithm)
+    sk_alice = b'a' * 32
+    sk_bob = b'b' * 32
+    rekey = pre.rekey(sk_alice, pre.priv2pub(sk_bob))
+    daemon_client.store_rekeys(b'pub', b'alice-to-bob', rekey, default_algorithm)
+
+    messages = [('Hello world %s' % i).encode() for i in range(20)]
+    ekeys = [pre.encrypt(pre.priv2pub(sk_alice), m) for m in messages]
+    # All of them are sent before any response is read
+    reencryptions = [daemon_client.call('reencrypt', b'pub', b'alice-to-bob', ekey) for ekey in ekeys]
+    assert [pre.decrypt(sk_bob, r.result()) for r in reencryptions] == messages
+    # ...or all in one request
+    reencrypted = daemon_client.reencrypt_many(b'pub', b'alice-to-bob', ekeys)
+    assert [pre.decrypt(sk_bob, r) for r in reencrypted] == messages
+
+    daemon_client.remove_rekeys(b'pub', b'alice-to-bob')
+    with pytest.raises(KeyError):
+        daemon_client.reencrypt(b'pub', b'alice-to-bob', ekeys[0])
+    with pytest.raises(daemon.DaemonError):
+        daemon_client.call('close').result()
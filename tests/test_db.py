@@ -1,5 +1,6 @@
 from nkms.db import DB
 import pytest
+import threading
 
 
 def test_db():
@@ -28,3 +29,36 @@ def test_store_dict():
     db[b'x'] = {b'a': 1, b'b': 2}
     assert db[b'x'][b'a'] == 1
     db.close()
+
+
+def test_same_path_shares_one_environment():
+    db = DB()
+    db2 = DB()
+    assert db.db is db2.db
+
+    # Closing one doesn't pull the environment from under the other
+    db.close()
+    db2[b'x'] = b'y'
+    assert db2[b'x'] == b'y'
+    del db2[b'x']
+    db2.close()
+
+
+def test_db_shared_between_threads():
+    db = DB()
+
+    def write(i):
+        for j in range(50):
+            db[b'%d-%d' % (i, j)] = j
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(db[b'%d-%d' % (i, j)] == j for i in range(8) for j in range(50))
+    for i in range(8):
+        for j in range(50):
+            del db[b'%d-%d' % (i, j)]
+    db.close()
@@ -2,6 +2,7 @@ from nkms.crypto import default_algorithm
 from nkms.crypto import symmetric_from_algorithm
 from nkms.crypto import pre_from_algorithm
 from nkms import crypto
+from nkms.crypto.pre import bbs98
 
 
 def test_symmetric():
@@ -36,3 +37,28 @@ def test_pre():
     cyphertext_for_bob = pre.reencrypt(rk_alice_bob, cyphertext_for_alice)
     # ...and sure enough, Bob can read it!
     assert pre.decrypt(sk_bob, cyphertext_for_bob) == cleartext
+
+
+def test_pre_parsed_rekeys():
+    pre = pre_from_algorithm(default_algorithm)
+
+    sk_alice = b'a' * 32
+    sk_bob = b'b' * 32
+    sk_carol = b'c' * 32
+
+    rk_alice_bob = pre.rekey(sk_alice, pre.priv2pub(sk_bob))
+    rk_alice_carol = pre.rekey(sk_alice, pre.priv2pub(sk_carol))
+
+    # The same rekey under the same id is parsed once...
+    parsed = pre.load_rekey(rk_alice_bob, rekey_id=b'k')
+    assert pre.load_rekey(rk_alice_bob, rekey_id=b'k') is parsed
+    assert pre.load_rekey(parsed) is parsed
+    # ...but a new rekey under an old id isn't mistaken for the old one
+    assert pre.load_rekey(rk_alice_carol, rekey_id=b'k') is not parsed
+
+    cleartext = b'Hello world'
+    cyphertext_for_alice = pre.encrypt(pre.priv2pub(sk_alice), cleartext)
+    cyphertexts_for_bob = pre.reencrypt_many(parsed, [cyphertext_for_alice] * 2)
+    for cyphertext_for_bob in cyphertexts_for_bob:
+        assert pre.decrypt(sk_bob, cyphertext_for_bob) == cleartext
+        assert pre.decrypt(sk_bob, bbs98.Ciphertext.from_bytes(cyphertext_for_bob)) == cleartext
@@ -0,0 +1,31 @@
+from nacl.utils import random
+
+from nkms.crypto.keycache import DataKeyCache
+
+
+def test_data_keys_expire_and_are_zeroed():
+    cache = DataKeyCache(ttl=60, max_entries=2)
+    enc_keys = [random(148) for _ in range(3)]
+    data_keys = [random(32) for _ in range(3)]
+
+    cache.put(enc_keys[0], data_keys[0], path=b'/foo')
+    assert cache.get(enc_keys[0], path=b'/foo') == data_keys[0]
+    # Same wrapped key, other path: not the same entry
+    assert cache.get(enc_keys[0]) is None
+
+    stored = cache.entries[cache._hash(enc_keys[0], b'/foo')][1]
+    cache.put(enc_keys[1], data_keys[1])
+    cache.put(enc_keys[2], data_keys[2])
+    # The least recently used key went, and was zeroed on its way out
+    assert cache.get(enc_keys[0], path=b'/foo') is None
+    assert stored == bytearray(32)
+
+    expires, stored = cache.entries[cache._hash(enc_keys[1], None)]
+    cache.entries[cache._hash(enc_keys[1], None)] = (expires - 61, stored)
+    assert cache.get(enc_keys[1]) is None
+    assert stored == bytearray(32)
+
+    stored = cache.entries[cache._hash(enc_keys[2], None)][1]
+    cache.purge()
+    assert cache.get(enc_keys[2]) is None
+    assert stored == bytearray(32)
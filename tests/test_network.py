@@ -1,8 +1,17 @@
 import asyncio
+import random
+from collections import Counter
 
 import pytest
+from kademlia.utils import digest
 
+from nkms.crypto import default_algorithm, pre_from_algorithm
+from nkms.network.admission import AdmissionControl
+from nkms.network.constants import NODE_IS_OVERLOADED
+from nkms.network.node import NuCypherNode
+from nkms.network.protocols import NuCypherHashProtocol
 from nkms.network.server import NuCypherSeedOnlyDHTServer, NuCypherDHTServer
+from nkms.network.simulation import SimulatedEventLoop, SimulatedNetwork
 
 
 # Kademlia emits a bunch of useful logging info; uncomment below to see it.
@@ -127,3 +136,591 @@ def test_seed_only_node_knows_it_can_store_on_full_node():
     seed_only_server.stop()
     full_server.stop()
     event_loop.close()
+
+
+def test_set_digest_reports_outcome_per_node():
+    """
+    Stores go out to all the nearest nodes concurrently, and the caller can
+    see what happened on each of them.
+    """
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+
+    full_server = NuCypherDHTServer()
+    full_server.listen(8468)
+    event_loop.run_until_complete(full_server.bootstrap([("127.0.0.1", 8468)]))
+
+    seed_only_server = NuCypherSeedOnlyDHTServer()
+    seed_only_server.listen(8471)
+    event_loop.run_until_complete(seed_only_server.bootstrap([("127.0.0.1", 8468)]))
+
+    outcomes = {}
+    setter = seed_only_server.set_digest(digest("llamas"), "tons_of_things_keyed_llamas",
+                                         quorum=1, timeout=1, outcomes=outcomes)
+    result = event_loop.run_until_complete(setter)
+    assert result
+
+    # The full node accepted the value.
+    assert outcomes[full_server.node.id] == (True, True)
+
+    # annnnd stop.
+    seed_only_server.stop()
+    full_server.stop()
+    event_loop.close()
+
+
+def test_threshold_rekey_shares_are_reencrypted_by_their_holders():
+    """
+    Each share of an m-of-n rekey is stored on its own node, and a re-encryption
+    request is answered by the first m share holders.
+    """
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+
+    full_server = NuCypherDHTServer()
+    full_server.listen(8468)
+    event_loop.run_until_complete(full_server.bootstrap([("127.0.0.1", 8468)]))
+
+    seed_only_server = NuCypherSeedOnlyDHTServer()
+    seed_only_server.listen(8471)
+    event_loop.run_until_complete(seed_only_server.bootstrap([("127.0.0.1", 8468)]))
+
+    pre = pre_from_algorithm(default_algorithm)
+    sk_alice = b'a' * 32
+    sk_bob = b'b' * 32
+    ekey = pre.encrypt(pre.priv2pub(sk_alice), b'Hello world')
+
+    # With only one storage node around, we can place a single share.
+    dkey = digest("alice-to-bob")
+    shares = [pre.rekey(sk_alice, pre.priv2pub(sk_bob))]
+    setter = seed_only_server.store_rekey_shares(dkey, shares, default_algorithm)
+    assert event_loop.run_until_complete(setter)
+
+    # The share is not replicated back to the seed-only node.
+    assert len(list(seed_only_server.storage.items())) == 0
+
+    reencryption = seed_only_server.reencrypt_digest(dkey, ekey, m=1, timeout=1)
+    pieces = event_loop.run_until_complete(reencryption)
+    assert len(pieces) == 1
+    share_index, reencrypted_ekey = pieces[0]
+    assert share_index == 0
+    assert pre.decrypt(sk_bob, reencrypted_ekey) == b'Hello world'
+
+    # Nobody will store the share again, so its holder keeps it from
+    # expiring, without sending it anywhere.
+    republisher = full_server.republisher
+    birthday, share = full_server.storage.data[dkey]
+    full_server.storage.data[dkey] = (birthday - republisher.due_age, share)
+    event_loop.run_until_complete(republisher.run())
+    assert republisher.shares_refreshed == 1
+    assert republisher.keys_republished == 0
+    assert full_server.storage.data[dkey][0] >= birthday
+
+    # annnnd stop.
+    seed_only_server.stop()
+    full_server.stop()
+    event_loop.close()
+
+
+def test_warm_restart_from_saved_routing_table(tmpdir):
+    """
+    A restarted node gets its contacts back, capabilities included, with one
+    round of pings and no crawl.
+    """
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 10))
+    event_loop.run_until_complete(network.spawn(NuCypherSeedOnlyDHTServer, 5))
+
+    # This seed-only node introduces itself to the one we'll restart
+    server = full_servers[0]
+    seed_only_server = NuCypherSeedOnlyDHTServer()
+    network.listen(seed_only_server)
+    event_loop.run_until_complete(seed_only_server.bootstrap([server.transport.address]))
+
+    fname = str(tmpdir.join('routing-table'))
+    server.save_routing_table(fname)
+    known = {n.id for n in server.protocol.router.findNeighbors(server.node, k=100)}
+    address = server.transport.address
+    server.stop()
+
+    node_id, contacts = NuCypherDHTServer.load_routing_table(fname)
+    assert node_id == server.node.id
+    assert {n.id for n in contacts} == known
+
+    restarted_server = NuCypherDHTServer(id=node_id)
+    network.listen(restarted_server, address)
+    messages = network.messages
+    nodes = event_loop.run_until_complete(restarted_server.warm_bootstrap(fname))
+
+    assert {n.id for n in nodes} == known
+    # A ping and a pong per contact, and nothing else
+    assert network.messages - messages == 2 * len(known)
+
+    # ...and we still know not to store anything there.
+    assert not restarted_server.protocol.router.can_store(seed_only_server.node)
+
+    event_loop.close()
+
+
+def test_republish_only_what_is_due_or_moved():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    servers = []
+    for i in range(10):
+        servers += event_loop.run_until_complete(
+            network.spawn(NuCypherDHTServer, 1, ksize=4, id=digest("server-%d" % i)))
+    server, other_server = servers[:2]
+    republisher = server.republisher
+    for s in (server, other_server):
+        s.storage[digest("llamas")] = "tons_of_things_keyed_llamas"
+    server.storage[digest("european_swallow")] = "grip_it_by_the_husk"
+
+    # Values which have just arrived were just published by someone else.
+    messages = network.messages
+    event_loop.run_until_complete(republisher.run())
+    assert republisher.keys_republished == 0
+    assert network.messages == messages
+
+    def age(s, key):
+        birthday, value = s.storage.data[key]
+        s.storage.data[key] = (birthday - s.republisher.due_age, value)
+
+    # Once a key is due, it goes out to its closest nodes, and only it does.
+    age(server, digest("llamas"))
+    age(other_server, digest("llamas"))
+    event_loop.run_until_complete(republisher.run())
+    assert republisher.keys_republished == 1
+    closest = republisher.closest_nodes(digest("llamas"))
+    assert network.messages - messages == 2 * len(closest)
+
+    # That was a fresh publish, for us and for the other holders of the key,
+    # so none of us sends it again.
+    messages = network.messages
+    event_loop.run_until_complete(republisher.run())
+    event_loop.run_until_complete(other_server.republisher.run())
+    assert republisher.keys_republished == 1
+    assert other_server.republisher.keys_republished == 0
+    assert network.messages == messages
+
+    # If one of their closest nodes leaves, keys move, but only to the node
+    # which took its place...
+    swallow_closest = republisher.closest_nodes(digest("european_swallow"))
+    assert closest[-1].id in [n.id for n in swallow_closest[:-1]]
+    server.protocol.router.removeContact(closest[-1])
+    entrants = set()
+    for key, before in (("llamas", closest), ("european_swallow", swallow_closest)):
+        entrant = republisher.closest_nodes(digest(key))[-1]
+        assert entrant.id not in [n.id for n in before]
+        entrants.add(entrant.id)
+    messages = network.messages
+    event_loop.run_until_complete(republisher.run())
+    assert republisher.keys_republished == 3
+    assert network.messages - messages == 2 * len(entrants)
+    # ...and only once.
+    event_loop.run_until_complete(republisher.run())
+    assert republisher.keys_republished == 3
+
+    # A run which is still going isn't joined by another one.
+    age(server, digest("european_swallow"))
+    event_loop.run_until_complete(asyncio.gather(republisher.run(), republisher.run()))
+    assert republisher.keys_republished == 4
+
+    event_loop.close()
+
+
+def test_keys_stay_put_when_fewer_than_k_nodes_are_around():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 10))
+    server = servers[0]
+    server.storage[digest("llamas")] = "tons_of_things_keyed_llamas"
+
+    # Nobody takes the place of a node which leaves, so nothing moves.
+    messages = network.messages
+    server.protocol.router.removeContact(server.republisher.closest_nodes(digest("llamas"))[0])
+    event_loop.run_until_complete(server.republisher.run())
+    assert server.republisher.keys_republished == 0
+    assert network.messages == messages
+
+    event_loop.close()
+
+
+def test_contacts_leave_only_after_failing_to_answer_repeatedly():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 3))
+    server, gone = servers[0], servers[1]
+    router = server.protocol.router
+    assert not router.isNewNode(gone.node)
+    del network.endpoints[gone.transport.address]
+
+    # A datagram or two going missing doesn't make a node leave...
+    for _ in range(router.max_failures - 1):
+        event_loop.run_until_complete(server.protocol.callPing(gone.node))
+    assert not router.isNewNode(gone.node)
+    assert not router.departed
+
+    # ...while a node which stopped answering does.
+    event_loop.run_until_complete(server.protocol.callPing(gone.node))
+    assert router.isNewNode(gone.node)
+    assert list(router.departed) == [gone.node.id]
+
+    event_loop.close()
+
+
+def test_nodes_sharing_storage_republish_only_their_own_keys():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 10))
+    server, other_server = servers[:2]
+    republisher = server.republisher
+    republisher.shared_with = [other_server.node.id]
+
+    dkeys = [digest("key-%s" % i) for i in range(20)]
+    for dkey in dkeys:
+        server.storage[dkey] = b"value"
+        birthday, value = server.storage.data[dkey]
+        server.storage.data[dkey] = (birthday - republisher.due_age, value)
+
+    # The other node republishes the keys it's closer to.
+    ours = [dkey for dkey in dkeys if server.node.distanceTo(NuCypherNode(dkey)) <
+            other_server.node.distanceTo(NuCypherNode(dkey))]
+    assert 0 < len(ours) < len(dkeys)
+    event_loop.run_until_complete(republisher.run())
+    assert republisher.keys_republished == len(ours)
+
+    event_loop.close()
+
+
+def test_new_nodes_get_the_keys_they_should_hold_in_the_background():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    server, other_server = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 2))
+    dkeys = [digest("key-%d" % i) for i in range(250)]
+    for dkey in dkeys:
+        server.storage[dkey] = b"value"
+
+    newcomer, = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 1))
+    event_loop.run_until_complete(asyncio.sleep(10))
+
+    # Keys go to the new node if it's now closer to them than the farthest
+    # of the others, and we were the closest
+    def distance(s, dkey):
+        return s.node.distanceTo(NuCypherNode(digest(dkey)))
+    expected = {dkey for dkey in dkeys
+                if distance(newcomer, dkey) < distance(other_server, dkey) and
+                distance(server, dkey) < distance(other_server, dkey)}
+    assert 0 < len(expected) < len(dkeys)
+    assert set(newcomer.storage) == expected
+
+    event_loop.close()
+
+
+def test_concurrent_gets_share_one_crawl():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 20))
+    seed_only_server = NuCypherSeedOnlyDHTServer(value_cache_ttl=60)
+    network.listen(seed_only_server)
+    event_loop.run_until_complete(seed_only_server.bootstrap([full_servers[0].transport.address]))
+    event_loop.run_until_complete(full_servers[1].set("llamas", "tons_of_things_keyed_llamas"))
+
+    messages = network.messages
+    getters = [seed_only_server.get("llamas") for _ in range(50)]
+    values = event_loop.run_until_complete(asyncio.gather(*getters))
+    assert values == ["tons_of_things_keyed_llamas"] * 50
+    assert seed_only_server.gets_in_flight.coalesced == 49
+
+    # The value is cached now...
+    messages = network.messages
+    assert event_loop.run_until_complete(seed_only_server.get("llamas")) == "tons_of_things_keyed_llamas"
+    assert network.messages == messages
+
+    # ...until we set it ourselves, and then it's the value we've set.
+    event_loop.run_until_complete(seed_only_server.set("llamas", "more_things_keyed_llamas"))
+    messages = network.messages
+    assert event_loop.run_until_complete(seed_only_server.get("llamas")) == "more_things_keyed_llamas"
+    assert network.messages == messages
+
+    # A get which was under way when we set the value doesn't cache the old one.
+    event_loop.run_until_complete(full_servers[1].set("alpacas", "tons_of_things_keyed_alpacas"))
+    getter = asyncio.ensure_future(seed_only_server.get("alpacas"))
+    setter = seed_only_server.set("alpacas", "more_things_keyed_alpacas")
+    event_loop.run_until_complete(asyncio.gather(getter, setter))
+    assert event_loop.run_until_complete(seed_only_server.get("alpacas")) == "more_things_keyed_alpacas"
+
+    event_loop.close()
+
+
+def test_set_digest_routes_around_overloaded_nodes():
+    # Node ids are random; fix them, so that there's a spare storage node
+    # in the seed-only node's (small) routing table
+    random.seed(0)
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 10, ksize=3))
+    seed_only_server = NuCypherSeedOnlyDHTServer(ksize=3)
+    network.listen(seed_only_server)
+    event_loop.run_until_complete(seed_only_server.bootstrap([full_servers[0].transport.address]))
+
+    dkey = digest("llamas")
+    nodes = event_loop.run_until_complete(seed_only_server.find_storage_nodes(dkey))
+    busy_node = nodes[0]
+    busy_server = next(s for s in full_servers if s.node.id == busy_node.id)
+    busy_server.protocol.admission_control = AdmissionControl(max_concurrent_stores=0)
+
+    outcomes = {}
+    setter = seed_only_server.set_digest(dkey, "tons_of_things_keyed_llamas", quorum=3, timeout=1, outcomes=outcomes)
+    assert event_loop.run_until_complete(setter)
+
+    # The busy node turned the store away, and someone else took its place.
+    assert outcomes[busy_node.id] == (NODE_IS_OVERLOADED, False)
+    assert busy_server.storage.get(dkey) is None
+    assert len([o for o in outcomes.values() if o == (True, True)]) == 3
+
+    # For a while, no more stores are sent its way.
+    router = seed_only_server.protocol.router
+    assert router.is_overloaded(busy_node)
+    assert busy_node.id not in {n.id for n in router.findNeighbors(busy_node, can_store=True)}
+    messages = network.messages
+    stored = event_loop.run_until_complete(seed_only_server.store_on_node(busy_node, dkey, "more_things"))
+    assert stored == (NODE_IS_OVERLOADED, False)
+    assert network.messages == messages
+
+    event_loop.close()
+
+
+def test_values_are_stored_once_per_host():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    dkey = digest("llamas")
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 10, ksize=3))
+    # Two workers of one host, sharing its storage, closer to the key than anyone
+    host, _ = network.next_address()
+    workers = []
+    for port, last_byte in ((8468, 1), (8469, 2)):
+        worker = NuCypherDHTServer(ksize=3, id=dkey[:-1] + bytes([dkey[-1] ^ last_byte]))
+        network.listen(worker, (host, port))
+        event_loop.run_until_complete(worker.bootstrap([full_servers[0].transport.address]))
+        workers.append(worker)
+    setter_server = full_servers[-1]
+    nodes = event_loop.run_until_complete(setter_server.find_storage_nodes(dkey))
+    assert {n.id for n in nodes[:2]} == {w.node.id for w in workers}
+
+    outcomes = {}
+    setter = setter_server.set_digest(dkey, "tons_of_things_keyed_llamas", quorum=3, outcomes=outcomes)
+    assert event_loop.run_until_complete(setter)
+
+    # Only one of the workers is sent the value, and the third copy goes to
+    # another host instead
+    assert workers[0].node.id in outcomes
+    assert workers[1].node.id not in outcomes
+    assert len(outcomes) == 3
+    assert all(o == (True, True) for o in outcomes.values())
+
+    event_loop.close()
+
+
+class OldProtocol(NuCypherHashProtocol):
+    # As on nodes from before find_storage_node, which ignore it
+    rpc_find_storage_node = None
+
+
+class OldDHTServer(NuCypherDHTServer):
+    protocol_class = OldProtocol
+
+
+def test_storage_node_lookups_fall_back_to_find_node_on_old_nodes():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    old_servers = event_loop.run_until_complete(network.spawn(OldDHTServer, 5))
+    new_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 5))
+    server = new_servers[-1]
+    router = server.protocol.router
+
+    # Old nodes don't answer find_storage_node, but they still count, and
+    # we don't wait for them to time out.
+    started = event_loop.time()
+    nodes = event_loop.run_until_complete(server.find_storage_nodes(digest("llamas")))
+    assert {n.id for n in nodes} == {s.node.id for s in old_servers + new_servers[:-1]}
+    assert event_loop.time() - started < 1
+
+    # Once they have, we know which nodes are which.
+    event_loop.run_until_complete(asyncio.sleep(server.protocol._waitTimeout))
+    assert router.legacy == dict([(s.node.id, True) for s in old_servers] +
+                                 [(s.node.id, False) for s in new_servers[:-1]])
+
+    # From then on, each is asked with the one RPC it answers, even once
+    # it's no longer among our contacts.
+    router.removeContact(old_servers[0].node)
+    server.lookup_cache.clear()
+    started, messages = event_loop.time(), network.messages
+    nodes = event_loop.run_until_complete(server.find_storage_nodes(digest("alpacas")))
+    assert len(nodes) == 9
+    assert event_loop.time() - started < 1
+    # A request and a response to each of them, at most
+    assert network.messages - messages <= 2 * 9
+
+    event_loop.close()
+
+
+def test_draining_node_turns_away_new_stores():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    server, other_server = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 2))
+    node = other_server.protocol.router.findNeighbors(other_server.node)[0]
+    assert node.id == server.node.id
+
+    # While the node waits on its own RPCs to finish, stores are turned away...
+    other_node = server.protocol.router.findNeighbors(server.node)[0]
+    ping = asyncio.ensure_future(server.protocol.callPing(other_node))
+    drain = asyncio.ensure_future(server.drain(timeout=1))
+    store = other_server.store_on_node(node, digest("llamas"), "tons_of_things_keyed_llamas")
+    assert event_loop.run_until_complete(store) == (NODE_IS_OVERLOADED, False)
+    assert server.storage.get(digest("llamas")) is None
+
+    # ...and once they're done, it goes away.
+    event_loop.run_until_complete(drain)
+    assert ping.done()
+    assert server.transport.address not in network.endpoints
+
+    event_loop.close()
+
+
+def test_set_digests_crawls_once_per_neighbourhood():
+    random.seed(0)
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 100, ksize=5))
+    seed_only_server = NuCypherSeedOnlyDHTServer(ksize=5)
+    network.listen(seed_only_server)
+    event_loop.run_until_complete(seed_only_server.bootstrap([full_servers[0].transport.address]))
+
+    # A crawl for a single key, with nothing cached yet
+    dkeys = [digest("key-%s" % i) for i in range(200)]
+    messages = network.messages
+    event_loop.run_until_complete(seed_only_server.find_storage_nodes(dkeys[0]))
+    crawl_messages = network.messages - messages
+    seed_only_server.lookup_cache.clear()
+
+    messages = network.messages
+    results = event_loop.run_until_complete(seed_only_server.set_digests(dict.fromkeys(dkeys, b"value")))
+    assert results == dict.fromkeys(dkeys, True)
+    # Keys are crawled for by neighbourhood (100 nodes make 20 of them),
+    # rather than one at a time
+    assert seed_only_server.lookup_cache.misses < len(dkeys) / 3
+    assert network.messages - messages < len(dkeys) * crawl_messages / 4
+
+    # ...and keys which weren't crawled for still get (almost all of) their
+    # closest nodes
+    seed_only_server.lookup_cache.clear()
+    found = event_loop.run_until_complete(seed_only_server.find_storage_nodes_many(dkeys))
+
+    def closest(dkey):
+        key_node = NuCypherNode(dkey)
+        return {s.node.id for s in sorted(full_servers, key=lambda s: s.node.distanceTo(key_node))[:5]}
+    assert set(found) == set(dkeys)
+    assert all(len(nodes) == 5 for nodes in found.values())
+    assert sum(len({n.id for n in found[dkey]} & closest(dkey)) for dkey in dkeys) >= 0.95 * 5 * len(dkeys)
+
+    event_loop.close()
+
+
+def test_batched_stores_and_reencryptions_cost_a_round_trip_per_node():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 5))
+    seed_only_server = NuCypherSeedOnlyDHTServer()
+    network.listen(seed_only_server)
+    event_loop.run_until_complete(seed_only_server.bootstrap([full_servers[0].transport.address]))
+
+    # Enough values that they don't fit in a single datagram
+    items = {digest("key-%s" % i): ("value-%s" % i).encode() * 10 for i in range(100)}
+    nodes = {n.id for dkey in items
+             for n in event_loop.run_until_complete(seed_only_server.find_storage_nodes(dkey))}
+    messages = network.messages
+    results = event_loop.run_until_complete(seed_only_server.set_digests(items))
+    assert results == dict.fromkeys(items, True)
+    assert all(s.storage.get(dkey) == value for s in full_servers for dkey, value in items.items())
+    # A request and a response per node for each datagram's worth of
+    # values, and these take two
+    assert network.messages - messages == 2 * len(nodes) * 2
+
+    pre = pre_from_algorithm(default_algorithm)
+    sk_alice = b'a' * 32
+    sk_bob = b'b' * 32
+    plaintexts = [('Hello world %s' % i).encode() for i in range(10)]
+    ekeys = [pre.encrypt(pre.priv2pub(sk_alice), p) for p in plaintexts]
+
+    dkey = digest("alice-to-bob")
+    shares = [pre.rekey(sk_alice, pre.priv2pub(sk_bob))]
+    assert event_loop.run_until_complete(seed_only_server.store_rekey_shares(dkey, shares, default_algorithm))
+
+    reencryption = seed_only_server.reencrypt_digest_many(dkey, ekeys, m=1, timeout=1)
+    pieces = event_loop.run_until_complete(reencryption)
+    assert [pre.decrypt(sk_bob, p[0][1]) for p in pieces] == plaintexts
+
+    event_loop.close()
+
+
+def test_set_digests_paces_stores_and_routes_around_overloaded_nodes():
+    # As in test_set_digest_routes_around_overloaded_nodes
+    random.seed(0)
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(seed=0)
+
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 10, ksize=3))
+    seed_only_server = NuCypherSeedOnlyDHTServer(ksize=3)
+    network.listen(seed_only_server)
+    event_loop.run_until_complete(seed_only_server.bootstrap([full_servers[0].transport.address]))
+
+    items = {digest("key-%s" % i): ("value-%s" % i).encode() * 10 for i in range(100)}
+    items_per_node = Counter(n.id for dkey in items
+                             for n in event_loop.run_until_complete(seed_only_server.find_storage_nodes(dkey)))
+    busy_node = event_loop.run_until_complete(seed_only_server.find_storage_nodes(digest("key-0")))[0]
+    busy_server = next(s for s in full_servers if s.node.id == busy_node.id)
+    busy_server.protocol.admission_control = AdmissionControl(max_concurrent_stores=0)
+    del items_per_node[busy_node.id]
+
+    # Past the first few, items go out a few a second.
+    protocol = seed_only_server.protocol
+    protocol.store_many_burst, protocol.store_many_rate = 20, 100
+    started = event_loop.time()
+    results = event_loop.run_until_complete(seed_only_server.set_digests(items, quorum=3, timeout=1))
+    assert event_loop.time() - started >= protocol.store_many_duration(max(items_per_node.values())) > 0
+
+    # The busy node's values went elsewhere.
+    assert results == dict.fromkeys(items, True)
+    assert all(busy_server.storage.get(dkey) is None for dkey in items)
+    assert all(len([s for s in full_servers if s.storage.get(dkey) == value]) >= 3
+               for dkey, value in items.items())
+
+    event_loop.close()
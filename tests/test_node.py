@@ -0,0 +1,60 @@
+import pytest
+from kademlia.utils import digest
+
+from nkms.network.capabilities import SeedOnly, ServerCapability, register_capability
+from nkms.network.node import NuCypherNode
+from nkms.network.protocols import NuCypherHashProtocol
+from nkms.network.server import NuCypherDHTServer, NuCypherSeedOnlyDHTServer
+
+
+def test_node_capabilities_as_bitmask():
+    node = NuCypherNode(digest('seed'), '127.0.0.1', 8471, capabilities=[SeedOnly()])
+    assert node.capability_mask == SeedOnly.bit
+    assert not node.can_store()
+    assert [type(c) for c in node.capabilities] == [SeedOnly]
+    assert node.long_id == int(node.id.hex(), 16)
+
+    full_node = NuCypherNode(digest('full'), '127.0.0.1', 8468)
+    assert full_node.capability_mask == 0
+    assert full_node.can_store()
+
+    with pytest.raises(AttributeError):
+        node.nickname = 'Larry'
+
+
+def test_capabilities_on_the_wire():
+    # Pings carry names, which older nodes understand too.
+    assert NuCypherSeedOnlyDHTServer().serialize_capabilities() == ['SeedOnly']
+    assert NuCypherDHTServer().serialize_capabilities() == []
+
+    # Bitmasks and lists of names decode the same.
+    assert ServerCapability.bitmask_from_wire(ServerCapability.to_bitmask([SeedOnly()])) == SeedOnly.bit
+    assert ServerCapability.bitmask_from_wire(['SeedOnly']) == SeedOnly.bit
+    assert ServerCapability.bitmask_from_wire([]) == 0
+
+    node = NuCypherNode(digest('seed'), capabilities_as_strings=['SeedOnly'])
+    assert not node.can_store()
+    assert ServerCapability.names() == ['SeedOnly']
+
+
+def test_capability_bits_are_unique():
+    with pytest.raises(ValueError):
+        @register_capability(0)
+        class Impostor(ServerCapability):
+            pass
+
+
+def test_bare_pings_keep_announced_capabilities():
+    protocol = NuCypherHashProtocol(NuCypherNode(digest('me')), {}, 20)
+    seed_only_node = NuCypherNode(digest('seed'), '127.0.0.1', 8471)
+
+    protocol.rpc_ping(('127.0.0.1', 8471), seed_only_node.id, ['SeedOnly'])
+    assert not protocol.router.can_store(seed_only_node)
+
+    # kademlia pings without capabilities, e.g. when a bucket is full.
+    protocol.rpc_ping(('127.0.0.1', 8471), seed_only_node.id)
+    assert not protocol.router.can_store(seed_only_node)
+
+    # ...but an empty list is an announcement like any other.
+    protocol.rpc_ping(('127.0.0.1', 8471), seed_only_node.id, [])
+    assert protocol.router.can_store(seed_only_node)
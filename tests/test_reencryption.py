@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from nkms.crypto import default_algorithm, pre_from_algorithm
+from nkms.network.reencryption import ReencryptionExecutor, ReencryptionQueueFull
+
+
+def test_reencryption_executor():
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    executor = ReencryptionExecutor(workers=2)
+
+    pre = pre_from_algorithm(default_algorithm)
+    sk_alice = b'a' * 32
+    sk_bob = b'b' * 32
+    rekey = pre.rekey(sk_alice, pre.priv2pub(sk_bob))
+    messages = [('Hello world %s' % i).encode() for i in range(10)]
+    ekeys = [pre.encrypt(pre.priv2pub(sk_alice), m) for m in messages]
+
+    reencryptions = [executor.reencrypt(b'alice-to-bob', default_algorithm, rekey, ekey) for ekey in ekeys]
+    # Two go to the workers, the rest wait in a single batch.
+    assert executor.in_flight == 2
+    assert executor.queued == 8
+
+    reencrypted = event_loop.run_until_complete(asyncio.gather(*reencryptions))
+    assert [pre.decrypt(sk_bob, e) for e in reencrypted] == messages
+
+    executor.shutdown()
+    event_loop.close()
+
+
+def test_reencryption_executor_rejects_when_full():
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    executor = ReencryptionExecutor(workers=1, max_queued=1)
+
+    pre = pre_from_algorithm(default_algorithm)
+    rekey = pre.rekey(b'a' * 32, pre.priv2pub(b'b' * 32))
+    ekey = pre.encrypt(pre.priv2pub(b'a' * 32), b'Hello world')
+
+    reencryptions = [executor.reencrypt(b'alice-to-bob', default_algorithm, rekey, ekey) for _ in range(2)]
+    with pytest.raises(ReencryptionQueueFull):
+        executor.reencrypt(b'alice-to-bob', default_algorithm, rekey, ekey)
+
+    # Batches which don't fit are turned away whole.
+    executor.max_queued = 2
+    with pytest.raises(ReencryptionQueueFull):
+        executor.reencrypt_many(b'alice-to-bob', default_algorithm, rekey, [ekey] * 2)
+    assert executor.queued == 1
+
+    event_loop.run_until_complete(asyncio.gather(*reencryptions))
+    executor.shutdown()
+    event_loop.close()
@@ -0,0 +1,83 @@
+import asyncio
+
+from kademlia.node import Node
+from kademlia.utils import digest
+
+from nkms.network.capabilities import SeedOnly
+from nkms.network.node import NuCypherNode
+from nkms.network.routing import NuCypherRoutingTable
+from nkms.network.simulation import SimulatedEventLoop
+
+
+def test_find_neighbors_filtered_by_capability():
+    router = NuCypherRoutingTable(None, 20, NuCypherNode(digest('me')))
+
+    full_nodes = [NuCypherNode(digest('full-%s' % i), '127.0.0.1', 9000 + i) for i in range(3)]
+    seed_only_nodes = [NuCypherNode(digest('seed-%s' % i), '127.0.0.1', 9100 + i,
+                                    capabilities=[SeedOnly()]) for i in range(3)]
+    for node in full_nodes + seed_only_nodes:
+        router.addContact(node)
+
+    # A plain kademlia node, which we've only been told about
+    stranger = Node(digest('stranger'), '127.0.0.1', 9200)
+    router.addContact(stranger)
+    # ...and a seed-only one which reached us w/o its capabilities
+    router.addContact(Node(digest('seed-3'), '127.0.0.1', 9103), seed_only=True)
+
+    key = NuCypherNode(digest('llamas'))
+    assert len(router.findNeighbors(key)) == 8
+
+    storage_neighbors = router.findNeighbors(key, can_store=True)
+    assert {n.id for n in storage_neighbors} == {n.id for n in full_nodes} | {stranger.id}
+
+    # Once removed, a node's capabilities are forgotten.
+    router.removeContact(seed_only_nodes[0])
+    assert seed_only_nodes[0].id not in router.capabilities
+
+    # Nor are they kept for nodes which never made it into the table.
+    passer_by = NuCypherNode(digest('passer-by'), '127.0.0.1', 9300, capabilities=[SeedOnly()])
+    router.remember_capabilities(passer_by)
+    assert passer_by.id not in router.capabilities
+
+
+def test_lookup_cache_reused_for_nearby_keys_until_a_node_fails():
+    router = NuCypherRoutingTable(None, 20, NuCypherNode(digest('me')))
+    cache = router.lookup_cache
+    nodes = [NuCypherNode(digest('full-%s' % i), '127.0.0.1', 9000 + i) for i in range(3)]
+    for node in nodes:
+        router.addContact(node)
+
+    key = NuCypherNode(b'\x01\x02' + digest('llamas')[2:])
+    nearby_key = NuCypherNode(b'\x01\x02' + digest('alpacas')[2:])
+    faraway_key = NuCypherNode(b'\x03\x04' + digest('llamas')[2:])
+
+    assert cache.get(key, 20) is None
+    cache.put(key, nodes, hops=3, rpcs=9)
+
+    assert cache.get(nearby_key, 2) == sorted(nodes, key=nearby_key.distanceTo)[:2]
+    assert cache.get(faraway_key, 20) is None
+    assert (cache.hits, cache.misses, cache.hops_saved, cache.rpcs_saved) == (1, 2, 3, 9)
+
+    # When the routing table drops one of the nodes, the result goes away.
+    router.removeContact(nodes[0])
+    assert cache.get(nearby_key, 20) is None
+
+
+def test_lookup_cache_and_backoff_go_by_the_event_loop_clock():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    router = NuCypherRoutingTable(None, 20, NuCypherNode(digest('me')))
+    node = NuCypherNode(digest('full'), '127.0.0.1', 9000)
+    router.addContact(node)
+    key = NuCypherNode(digest('llamas'))
+
+    router.lookup_cache.put(key, [node])
+    router.mark_overloaded(node)
+    event_loop.run_until_complete(asyncio.sleep(router.overload_backoff + 1))
+    assert router.lookup_cache.get(key, 20) is not None
+    assert not router.is_overloaded(node)
+
+    event_loop.run_until_complete(asyncio.sleep(router.lookup_cache.ttl))
+    assert router.lookup_cache.get(key, 20) is None
+
+    event_loop.close()
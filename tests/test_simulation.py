@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from nkms.network.server import NuCypherSeedOnlyDHTServer, NuCypherDHTServer
+from nkms.network.simulation import SimulatedEventLoop, SimulatedNetwork
+
+
+def test_simulated_network():
+    """
+    Lots of nodes in one process, w/o binding any ports or waiting for anything.
+    """
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(latency=0.05, jitter=0.02, seed=0)
+
+    started = time.time()
+    full_servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 40))
+    seed_only_servers = event_loop.run_until_complete(network.spawn(NuCypherSeedOnlyDHTServer, 10))
+
+    setter = seed_only_servers[0].set("llamas", "tons_of_things_keyed_llamas")
+    assert event_loop.run_until_complete(setter)
+    getter = seed_only_servers[-1].get("llamas")
+    assert event_loop.run_until_complete(getter) == "tons_of_things_keyed_llamas"
+
+    # Only the full nodes store anything.
+    assert any(len(list(s.storage.items())) for s in full_servers)
+    assert not any(len(list(s.storage.items())) for s in seed_only_servers)
+
+    # Latency was simulated, not waited for.
+    assert event_loop.time() > 1
+    assert time.time() - started < event_loop.time()
+    assert network.messages > 0
+
+    event_loop.close()
+
+
+def test_simulated_loss_and_timeouts():
+    event_loop = SimulatedEventLoop()
+    asyncio.set_event_loop(event_loop)
+    network = SimulatedNetwork(latency=0.05, loss=1, seed=0)
+
+    servers = event_loop.run_until_complete(network.spawn(NuCypherDHTServer, 2))
+    # Nothing gets through, so the bootstrap ping times out after the
+    # protocol's 5 (simulated) seconds.
+    assert network.dropped == network.messages > 0
+    assert event_loop.time() >= 5
+    assert servers[1].protocol.router.findNeighbors(servers[0].node) == []
+
+    event_loop.close()
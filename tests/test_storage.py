@@ -0,0 +1,44 @@
+import time
+
+from nkms.network.storage import LMDBStorage
+
+
+def test_lmdb_storage(tmpdir):
+    storage = LMDBStorage(str(tmpdir.join('dht-db')))
+    storage[b'llamas'] = 'tons_of_things_keyed_llamas'
+    storage[b'european_swallow'] = b'grip_it_by_the_husk'
+
+    assert storage[b'llamas'] == 'tons_of_things_keyed_llamas'
+    assert storage.get(b'european_swallow') == b'grip_it_by_the_husk'
+    assert storage.get(b'african_swallow') is None
+    assert set(storage) == {b'llamas', b'european_swallow'}
+    storage.close()
+
+    # Values survive a restart
+    storage = LMDBStorage(str(tmpdir.join('dht-db')))
+    assert dict(storage.items()) == {
+            b'llamas': 'tons_of_things_keyed_llamas',
+            b'european_swallow': b'grip_it_by_the_husk'}
+    storage.close()
+
+
+def test_lmdb_storage_time_index(tmpdir, monkeypatch):
+    storage = LMDBStorage(str(tmpdir.join('dht-db')), ttl=100)
+    now = time.time()
+
+    monkeypatch.setattr(time, 'time', lambda: now - 50)
+    storage[b'old'] = b'value'
+    storage[b'refreshed'] = b'value'
+    monkeypatch.setattr(time, 'time', lambda: now)
+    storage[b'new'] = b'value'
+    storage[b'refreshed'] = b'new value'
+
+    assert list(storage.iteritemsOlderThan(10)) == [(b'old', b'value')]
+    assert len(list(storage.iteritemsOlderThan(0))) == 3
+
+    # Once past the ttl, old values are culled
+    monkeypatch.setattr(time, 'time', lambda: now + 60)
+    assert storage.get(b'old') is None
+    storage[b'newest'] = b'value'
+    assert set(storage) == {b'new', b'refreshed', b'newest'}
+    storage.close()